@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Benchmark of prepare, execute and cleanup against an in-process fake Kubernetes API, so that
+performance regressions can be found without a cluster.
+
+Usage:
+  python benchmarks/benchmark.py [--pods 10,100,1000] [--group-size N] [--namespaces N] [--batch]
+                                 [--concurrency N] [--exec-latency SECONDS] [--denied-latency SECONDS]
+                                 [--ready-delay SECONDS] [--no-watch] [--no-memory] [--verbose]
+
+For every number of pods, a config is generated with pod groups of --group-size pods. For every group
+there is a rule from the first pod of the group to the pods of the next group, with an allowed
+connection to port 80 and a denied connection to port 8443. The fake cluster allows port 80 and lets
+checks of other ports time out after --denied-latency seconds. All tests are expected to pass.
+
+For every phase the wall time, the number of API calls, and the peak of the memory that is allocated
+by python (tracemalloc, which slows down the benchmark) are reported. Before python 3.9 the peak cannot
+be reset, so the peak of a phase is the peak since the start of the benchmark.
+"""
+import contextlib
+import os
+import sys
+import tracemalloc
+from time import monotonic
+
+import yaml
+
+from fakekubernetes import FakeKubernetes
+from policytester import *
+from policytester.DebugContainerSpec import DebugContainerSpec
+
+
+# option -> (attribute, default value), see parse_options() in policytester/__main__.py
+OPTIONS = {
+    "--pods": ("pods", "10,100,1000"),
+    "--group-size": ("group_size", 10),
+    "--namespaces": ("namespaces", 10),
+    "--batch": ("batch", False),
+    "--concurrency": ("concurrency", 10),
+    "--exec-latency": ("exec_latency", 0.002),
+    "--denied-latency": ("denied_latency", 0.01),
+    "--ready-delay": ("ready_delay", 0.2),
+    "--no-watch": ("no_watch", False),
+    "--no-memory": ("no_memory", False),
+    "--verbose": ("verbose", False)
+}
+
+
+def usage(message=""):
+    print(__doc__, file=sys.stderr)
+    if message:
+        print(message, file=sys.stderr)
+    sys.exit(1)
+
+
+def parse_options(argv):
+    options = {attribute: default for attribute, default in OPTIONS.values()}
+    while argv:
+        option = argv.pop(0)
+        if option not in OPTIONS:
+            usage(f"Invalid option '{option}'")
+        attribute, default = OPTIONS[option]
+        if type(default) == bool:
+            options[attribute] = True
+            continue
+        if not argv:
+            usage(f"Option '{option}' requires a value")
+        value = argv.pop(0)
+        try:
+            options[attribute] = type(default)(value)
+        except ValueError:
+            usage(f"Invalid value '{value}' for option '{option}'")
+    return options
+
+
+def pod_name(i: int) -> str:
+    return f"app{i}-5d8f7"
+
+
+def generate_config(npods: int, group_size: int, nnamespaces: int) -> str:
+    ngroups = max(npods // group_size, 1)
+    lines = ["pods:"]
+    for i in range(npods):
+        lines += [f"  - name: p{i}", f"    namespace: ns{i % nnamespaces}", f"    podname: app{i}-"]
+    for g in range(ngroups):
+        members = [f"p{i}" for i in range(g * group_size, min((g + 1) * group_size, npods))]
+        lines += [f"  - name: g{g}", f"    pods: [{', '.join(members)}]"]
+    lines += ["connections:"]
+    for g in range(ngroups):
+        lines += [f"  - name: web{g}", f"    pods: [g{g}]", "    ports:", "      - port: 80"]
+        lines += [f"  - name: admin{g}", f"    pods: [g{g}]", "    ports:", "      - port: 8443"]
+    lines += ["rules:"]
+    for g in range(ngroups):
+        lines += [f"  - name: r{g}", f"    from: [p{g * group_size}]",
+                  f"    allowed: [web{(g + 1) % ngroups}]", f"    denied: [admin{(g + 1) % ngroups}]"]
+    return "\n".join(lines) + "\n"
+
+
+class Phase:
+    """
+    Measures wall time, API calls and memory of a phase.
+    """
+    def __init__(self, name: str, fake: FakeKubernetes, verbose: bool):
+        self.name = name
+        self.fake = fake
+        self.verbose = verbose
+
+    def __enter__(self):
+        self.calls = dict(self.fake.calls)
+        # reset_peak() requires python 3.9
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        # the output of the policy tester is discarded unless verbose
+        self.devnull = None if self.verbose else open(os.devnull, "w")
+        self.output = contextlib.redirect_stdout(self.devnull or sys.stdout)
+        self.output.__enter__()
+        self.t0 = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.time = monotonic() - self.t0
+        self.output.__exit__(exc_type, exc_val, exc_tb)
+        if self.devnull:
+            self.devnull.close()
+        self.peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        calls = {method: count - self.calls.get(method, 0) for method, count in self.fake.calls.items()}
+        self.calls = {method: count for method, count in sorted(calls.items()) if count}
+
+
+def run(npods: int, options: dict) -> bool:
+    """
+    :return: whether all phases succeeded
+    """
+    fake = FakeKubernetes(exec_latency=options["exec_latency"], denied_latency=options["denied_latency"],
+                          ready_delay=options["ready_delay"], delete_delay=options["ready_delay"])
+    for i in range(npods):
+        fake.add_pod(f"ns{i % options['namespaces']}", pod_name(i), f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+                     {"app": f"app{i}"})
+    debug_container = DebugContainerSpec(
+        "debugger", "appropriate/nc", ["sh", "-c", "tail -f /dev/null"],
+        tcp_check_command="nc -v -z -i 2 -w 2 {host} {port}",
+        udp_check_command="nc -v -zu -i 2 -w 2 {host} {port}"
+    )
+    phases = []
+    ok = True
+    cluster = None
+    try:
+        with Phase("config", fake, options["verbose"]) as phase:
+            tests = PolicyTests(yaml.load(generate_config(npods, options["group_size"], options["namespaces"]),
+                                          FastSafeLineLoader))
+        phases.append(phase)
+        if tests.error_messages:
+            for message in tests.error_messages:
+                print(message)
+            return False
+
+        with Phase("connect", fake, options["verbose"]) as phase:
+            cluster = Cluster(watch=not options["no_watch"], namespaces=tests.namespaces(selectors=False),
+                              corev1_factory=fake.api)
+        phases.append(phase)
+        tester = PolicyTester(tests, cluster, debug_container)
+
+        with Phase("prepare", fake, options["verbose"]) as phase:
+            pods = tester.prepare(concurrency=options["concurrency"])
+            not_ready = tester.wait_until_debug_container_ready(pods, 60)
+        phases.append(phase)
+        if not_ready:
+            print(f"{len(not_ready)} pods not ready")
+            ok = False
+
+        cluster.refresh_policy = RefreshPolicy(RefreshPolicy.MANUAL)
+        with Phase("execute", fake, options["verbose"]) as phase:
+            tester.test(batch=options["batch"], concurrency=options["concurrency"])
+        phases.append(phase)
+        if tester.test_report.nfail:
+            print(f"{tester.test_report.nfail} of {tester.test_report.ntests} tests failed")
+            ok = False
+
+        cluster.refresh_policy = RefreshPolicy()
+        with Phase("cleanup", fake, options["verbose"]) as phase:
+            pods = tester.cleanup(concurrency=options["concurrency"])
+            not_deleted = tester.wait_until_pods_deleted(pods, 60)
+        phases.append(phase)
+        if not_deleted:
+            print(f"{len(not_deleted)} pods not deleted")
+            ok = False
+    finally:
+        if cluster:
+            cluster.stop()
+        fake.stop()
+
+    for phase in phases:
+        memory = f"{phase.peak / 1e6:9.1f}" if phase.peak is not None else f"{'-':>9}"
+        calls = ", ".join(f"{method}={count}" for method, count in phase.calls.items())
+        print(f"{npods:>7} {phase.name:<8} {phase.time:9.3f} {sum(phase.calls.values()):>9} {memory}  {calls}")
+    print(f"{npods:>7} {'checks':<8} {tester.test_report.ntests:>9}")
+    sys.stdout.flush()
+    return ok
+
+
+def main():
+    options = parse_options(sys.argv[1:])
+    try:
+        sizes = [int(npods) for npods in options["pods"].split(",")]
+    except ValueError:
+        usage(f"Invalid value '{options['pods']}' for option '--pods'")
+    if not options["no_memory"]:
+        tracemalloc.start()
+    print(f"{'pods':>7} {'phase':<8} {'wall (s)':>9} {'api calls':>9} {'peak (MB)':>9}  calls per method")
+    ok = True
+    for npods in sizes:
+        ok = run(npods, options) and ok
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
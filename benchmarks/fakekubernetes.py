@@ -0,0 +1,346 @@
+import bisect
+import heapq
+import itertools
+import json
+import shlex
+import threading
+from collections import Counter
+from time import time, sleep
+from types import SimpleNamespace
+from typing import List, Dict, Tuple, Union
+
+from kubernetes import client
+from kubernetes.client import V1Pod, V1PodList, V1ObjectMeta, V1PodStatus, V1ListMeta, V1ContainerStatus, \
+    V1ContainerState, V1ContainerStateRunning, V1ContainerStateWaiting
+from kubernetes.client.exceptions import ApiException
+
+from policytester.kubernetes import label_selector_matches
+
+
+class FakePod:
+    """
+    State of a pod in the fake cluster.
+    """
+    def __init__(self, namespace: str, name: str, uid: str, ip: str, labels: Dict[str, str]):
+        self.namespace = namespace
+        self.name = name
+        self.uid = uid
+        self.ip = ip
+        self.labels = dict(labels)
+        # ephemeral container name -> whether it is running
+        self.ephemeral_containers: Dict[str, bool] = {}
+        self.deleting = False
+        self.resource_version = None
+        # V1Pod for the current resource version
+        self.v1pod = None
+
+    def to_v1pod(self) -> V1Pod:
+        if self.v1pod is None:
+            statuses = [
+                V1ContainerStatus(
+                    name=name, image="image", image_id="image", ready=running, restart_count=0,
+                    state=V1ContainerState(running=V1ContainerStateRunning()) if running else
+                    V1ContainerState(waiting=V1ContainerStateWaiting(reason="ContainerCreating")))
+                for name, running in self.ephemeral_containers.items()
+            ]
+            self.v1pod = V1Pod(
+                metadata=V1ObjectMeta(name=self.name, namespace=self.namespace, uid=self.uid,
+                                      labels=dict(self.labels), resource_version=self.resource_version),
+                status=V1PodStatus(phase="Running", pod_ip=self.ip, ephemeral_container_statuses=statuses or None))
+        return self.v1pod
+
+
+class FakeKubernetes:
+    """
+    In-process stand-in for the API server and the kubelets of a cluster. Pods are simulated including
+    the startup of ephemeral containers and the termination of deleted pods. Commands that are executed
+    in pods are interpreted: nc checks to port 80 succeed and checks to other ports time out. The number
+    of API calls is counted per method.
+    """
+    def __init__(self, exec_latency: float = 0.002, denied_latency: float = 0.01, ready_delay: float = 0.2,
+                 delete_delay: float = 0.2):
+        """
+        :param exec_latency: time to set up an exec session
+        :param denied_latency: time until a check of a denied connection times out
+        :param ready_delay: time until an ephemeral container is running
+        :param delete_delay: time until a deleted pod is gone
+        """
+        self.exec_latency = exec_latency
+        self.denied_latency = denied_latency
+        self.ready_delay = ready_delay
+        self.delete_delay = delete_delay
+        self.pods: Dict[Tuple[str, str], FakePod] = {}
+        self.resource_version = 0
+        # events as tuples (resource version, namespace, JSON line)
+        self.events: List[Tuple[int, str, bytes]] = []
+        self.event_versions: List[int] = []
+        self.calls = Counter()
+        self.condition = threading.Condition()
+        self.serializer = client.ApiClient()
+        # scheduled actions as tuples (time, sequence number, function)
+        self.scheduled = []
+        self.sequence = itertools.count()
+        self.stopped = False
+        self.kubelet = threading.Thread(target=self._run_kubelet, name="fake-kubelet", daemon=True)
+        self.kubelet.start()
+
+    def api(self) -> "FakeCoreV1Api":
+        return FakeCoreV1Api(self)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def add_pod(self, namespace: str, name: str, ip: str, labels: Dict[str, str] = None):
+        with self.condition:
+            pod = FakePod(namespace, name, f"uid-{namespace}-{name}", ip, labels or {})
+            self.pods[(namespace, name)] = pod
+            self._changed(pod, "ADDED")
+
+    def count(self, method: str):
+        with self.condition:
+            self.calls[method] += 1
+
+    def get_pod(self, name: str, namespace: str) -> FakePod:
+        pod = self.pods.get((namespace, name))
+        if pod is None:
+            raise ApiException(status=404, reason=f"pod {namespace}/{name} not found")
+        return pod
+
+    def list_pods(self, namespace: str = None, label_selector: str = None, field_selector: str = None) -> V1PodList:
+        name = field_selector.split("=", 1)[1] if field_selector else None
+        with self.condition:
+            items = [pod.to_v1pod() for pod in self.pods.values()
+                     if (namespace is None or pod.namespace == namespace) and (name is None or pod.name == name)
+                     and label_selector_matches(label_selector, pod.labels)]
+            return V1PodList(items=items, metadata=V1ListMeta(resource_version=str(self.resource_version)))
+
+    def _changed(self, pod: FakePod, event_type: str):
+        # called with the condition held
+        self.resource_version += 1
+        pod.resource_version = str(self.resource_version)
+        pod.v1pod = None
+        event = {"type": event_type, "object": self.serializer.sanitize_for_serialization(pod.to_v1pod())}
+        self.events.append((self.resource_version, pod.namespace, (json.dumps(event) + "\n").encode()))
+        self.event_versions.append(self.resource_version)
+        self.condition.notify_all()
+
+    def schedule(self, delay: float, function):
+        with self.condition:
+            heapq.heappush(self.scheduled, (time() + delay, next(self.sequence), function))
+            self.condition.notify_all()
+
+    def _run_kubelet(self):
+        with self.condition:
+            while not self.stopped:
+                if not self.scheduled:
+                    self.condition.wait()
+                    continue
+                t, _, function = self.scheduled[0]
+                if t > time():
+                    self.condition.wait(t - time())
+                    continue
+                heapq.heappop(self.scheduled)
+                function()
+
+    def label(self, pod: FakePod, labels: Dict[str, str]):
+        with self.condition:
+            for key, value in labels.items():
+                if value is None:
+                    pod.labels.pop(key, None)
+                else:
+                    pod.labels[key] = value
+            self._changed(pod, "MODIFIED")
+            return pod.to_v1pod()
+
+    def add_ephemeral_container(self, pod: FakePod, name: str):
+        with self.condition:
+            if name in pod.ephemeral_containers:
+                return
+            pod.ephemeral_containers[name] = False
+            self._changed(pod, "MODIFIED")
+
+        def start():
+            if not pod.deleting:
+                pod.ephemeral_containers[name] = True
+                self._changed(pod, "MODIFIED")
+        self.schedule(self.ready_delay, start)
+
+    def delete(self, pod: FakePod):
+        with self.condition:
+            if pod.deleting:
+                return
+            pod.deleting = True
+
+        def remove():
+            self.pods.pop((pod.namespace, pod.name), None)
+            self._changed(pod, "DELETED")
+        self.schedule(self.delete_delay, remove)
+
+    def execute(self, pod: FakePod, container: str, command: List[str]) -> Tuple[int, str, float]:
+        """
+        Interprets a command.
+        :return: tuple (exit status, output, duration)
+        """
+        if not pod.ephemeral_containers.get(container):
+            raise ApiException(status=400, reason=f"container {container} is not running in pod {pod.name}")
+        if command[:2] != ["sh", "-c"]:
+            return 127, f"sh: {command[0]}: not found\n", self.exec_latency
+        lines = []
+        exit_status = 0
+        duration = self.exec_latency
+        for line in command[2].splitlines():
+            args = shlex.split(line)
+            if args and args[0] == "echo":
+                lines.append(" ".join(args[1:]).replace("$?", str(exit_status)))
+                continue
+            if args[:2] == ["sh", "-c"]:
+                args = shlex.split(args[2])
+            exit_status, output, check_duration = self.check(args)
+            lines.append(output)
+            duration += check_duration
+        return exit_status, "\n".join(lines) + "\n", duration
+
+    def check(self, args: List[str]) -> Tuple[int, str, float]:
+        args = [arg for arg in args if arg not in ["2>&1"]]
+        if not args or args[0] != "nc" or len(args) < 3:
+            return 127, f"sh: {' '.join(args)}: not found", 0
+        host, port = args[-2], args[-1]
+        protocol = "udp" if "-zu" in args else "tcp"
+        if port == "80":
+            return 0, f"Connection to {host} {port} port [{protocol}/*] succeeded!", 0.0001
+        return 1, f"nc: connect to {host} port {port} ({protocol}) timed out: Operation in progress", \
+            self.denied_latency
+
+    def watch(self, namespace: str = None, resource_version: str = None) -> "FakeWatchResponse":
+        with self.condition:
+            position = bisect.bisect_right(self.event_versions, int(resource_version or self.resource_version))
+            return FakeWatchResponse(self, namespace, position)
+
+
+class FakeWatchResponse:
+    """
+    Response of a watch request, streams the events of the fake cluster as JSON lines.
+    """
+    def __init__(self, fake: FakeKubernetes, namespace: str, position: int):
+        self.fake = fake
+        self.namespace = namespace
+        self.position = position
+        self.closed = False
+
+    def stream(self, amt=None, decode_content=False):
+        fake = self.fake
+        while True:
+            with fake.condition:
+                while not self.closed and not fake.stopped and self.position >= len(fake.events):
+                    fake.condition.wait(1)
+                if self.closed or fake.stopped:
+                    return
+                events = fake.events[self.position:]
+                self.position = len(fake.events)
+            for _, namespace, line in events:
+                if self.namespace is None or namespace == self.namespace:
+                    yield line
+
+    def close(self):
+        with self.fake.condition:
+            self.closed = True
+            self.fake.condition.notify_all()
+
+    def release_conn(self):
+        pass
+
+
+class FakeExecResponse:
+    """
+    Stand-in for the websocket client of an exec request as used by Pod.exec(). The output is available
+    once the simulated duration of the command has passed.
+    """
+    def __init__(self, exit_status: int, output: str, duration: float):
+        self.exit_status = exit_status
+        self.output = output
+        self.ready_at = time() + duration
+        # no socket, so Pod.exec() waits in update()
+        self.sock = SimpleNamespace(sock=None)
+        self.open = True
+        self.read = False
+
+    def is_open(self) -> bool:
+        return self.open
+
+    def update(self, timeout=0):
+        remaining = self.ready_at - time()
+        if remaining > 0:
+            sleep(remaining)
+        if self.read:
+            self.open = False
+
+    def read_stdout(self, timeout=0) -> str:
+        if self.read or time() < self.ready_at:
+            return ""
+        self.read = True
+        return self.output
+
+    def read_stderr(self, timeout=0) -> str:
+        return ""
+
+    def close(self, timeout=None):
+        self.open = False
+
+    @property
+    def returncode(self) -> int:
+        return self.exit_status
+
+
+class FakeCoreV1Api:
+    """
+    Stand-in for client.CoreV1Api that implements the methods that are used by the policy tester on top of
+    a FakeKubernetes.
+    """
+    def __init__(self, fake: FakeKubernetes):
+        self.fake = fake
+        # used by kubernetes.stream.stream()
+        self.api_client = SimpleNamespace(configuration=client.Configuration(), request=None)
+
+    def list_namespaced_pod(self, namespace: str, label_selector: str = None, field_selector: str = None,
+                            watch: bool = False, resource_version: str = None, **kwargs):
+        """
+        :return: V1PodList
+        """
+        self.fake.count("list_namespaced_pod" if not watch else "watch_namespaced_pod")
+        if watch:
+            return self.fake.watch(namespace, resource_version)
+        return self.fake.list_pods(namespace, label_selector, field_selector)
+
+    def list_pod_for_all_namespaces(self, label_selector: str = None, field_selector: str = None,
+                                    watch: bool = False, resource_version: str = None, **kwargs):
+        """
+        :return: V1PodList
+        """
+        self.fake.count("list_pod_for_all_namespaces" if not watch else "watch_pod_for_all_namespaces")
+        if watch:
+            return self.fake.watch(None, resource_version)
+        return self.fake.list_pods(None, label_selector, field_selector)
+
+    def patch_namespaced_pod(self, name: str, namespace: str, body: V1Pod, **kwargs) -> V1Pod:
+        self.fake.count("patch_namespaced_pod")
+        metadata = body.metadata if isinstance(body.metadata, dict) else body.metadata.to_dict()
+        return self.fake.label(self.fake.get_pod(name, namespace), metadata.get("labels") or {})
+
+    def patch_namespaced_pod_ephemeralcontainers(self, name: str, namespace: str, body: dict, **kwargs):
+        self.fake.count("patch_namespaced_pod_ephemeralcontainers")
+        pod = self.fake.get_pod(name, namespace)
+        for container in body["spec"]["ephemeralContainers"]:
+            self.fake.add_ephemeral_container(pod, container["name"])
+        return SimpleNamespace(status=200)
+
+    def delete_namespaced_pod(self, name: str, namespace: str, **kwargs):
+        self.fake.count("delete_namespaced_pod")
+        self.fake.delete(self.fake.get_pod(name, namespace))
+
+    def connect_get_namespaced_pod_exec(self, name: str, namespace: str, container: str = None,
+                                        command: Union[str, List[str]] = None, **kwargs) -> FakeExecResponse:
+        self.fake.count("connect_get_namespaced_pod_exec")
+        command = [command] if isinstance(command, str) else command
+        return FakeExecResponse(*self.fake.execute(self.fake.get_pod(name, namespace), container, command))
@@ -0,0 +1,39 @@
+from .PolicyTests import Port
+from .kubernetes import Pod
+
+
+class Check:
+    """
+    A single network check from a source pod to a target address and port.
+    """
+    def __init__(self, id: int, suite: str, pod: Pod, target: str, target_address: str, port: Port,
+                 allowed: bool, target_namespace: str = None, source: str = None):
+        """
+        :param pod: replica of the source pod reference to check from
+        :param source: name of the source pod reference
+        """
+        self.id = id
+        self.suite = suite
+        self.pod = pod
+        self.source = source
+        self.target = target
+        self.target_address = target_address
+        self.port = port
+        # expected result
+        self.allowed = allowed
+        # namespace of the target pod, None if the target is not a pod
+        self.target_namespace = target_namespace
+        # description of the resolution of the target host name, see PolicyTester.resolve_hosts()
+        self.resolution: str = None
+
+    def rule(self) -> str:
+        """
+        :return: name of the rule, the suite is the rule name followed by '.allowed' or '.denied'.
+        """
+        return self.suite.rsplit(".", 1)[0]
+
+    def name(self):
+        return f"{self.pod}::{self.target}[{self.target_address}]:{self.port}"
+
+    def __repr__(self):
+        return f"Check {self.id}: {self.suite}: {self.name()} allowed={self.allowed}"
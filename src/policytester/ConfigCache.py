@@ -0,0 +1,66 @@
+import hashlib
+import os
+import pickle
+import sys
+
+import yaml
+
+from .PolicyTests import PolicyTests
+from .SafeLineLoader import FastSafeLineLoader
+
+
+class ConfigCache:
+    """
+    Cache of parsed and validated configurations on disk, keyed by a hash of the content of the config file.
+    The key also includes the code of the modules that load, validate and build the configuration, the
+    version of the package, and the python version so that a cached configuration is not used with a
+    different version of the code.
+
+    The cache contains pickled objects so the cache directory must only be writable by the user.
+    """
+    # modules of this package whose code determines the cached configuration
+    MODULES = ["SafeLineLoader", "ConfigValidator", "PolicyTests"]
+
+    def __init__(self, directory: str = None):
+        """
+        :param directory: cache directory, by default policytester in $XDG_CACHE_HOME or ~/.cache
+        """
+        if directory is None:
+            directory = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                                     "policytester")
+        self.directory = directory
+
+    def key(self, content: bytes) -> str:
+        h = hashlib.sha256()
+        h.update(content)
+        for module in ConfigCache.MODULES:
+            with open(sys.modules[f"{__package__}.{module}"].__file__, "rb") as f:
+                h.update(f.read())
+        h.update(sys.modules[__package__].__version__.encode())
+        h.update(sys.version.encode())
+        return h.hexdigest()
+
+    def load(self, filename: str) -> PolicyTests:
+        """
+        Loads a configuration from the cache, or parses it and adds it to the cache.
+        """
+        with open(filename, "rb") as f:
+            content = f.read()
+        cachefile = os.path.join(self.directory, self.key(content) + ".pickle")
+        if os.path.isfile(cachefile):
+            try:
+                with open(cachefile, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:
+                print(f"Ignoring config cache {cachefile}: {e}")
+
+        tests = PolicyTests(yaml.load(content, FastSafeLineLoader))
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            tmpfile = f"{cachefile}.{os.getpid()}.tmp"
+            with open(tmpfile, "wb") as f:
+                pickle.dump(tests, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpfile, cachefile)
+        except OSError as e:
+            print(f"Cannot write config cache {cachefile}: {e}")
+        return tests
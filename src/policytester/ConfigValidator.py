@@ -0,0 +1,115 @@
+from collections.abc import Mapping, Sequence
+from typing import List, Dict, Union
+
+
+class ConfigValidator:
+    """
+    Single pass validator for the configuration. It supports the subset of the cerberus schema syntax that is
+    used by PolicyTests.SCHEMA (type, schema, valuesrules, required, allowed, and anyof) and reports errors in the same
+    format and with the same messages as cerberus with require_all=True. The document is not copied and
+    '__line__' fields that are added by the SafeLineLoader are ignored.
+    """
+    TYPES = {
+        "string": lambda value: isinstance(value, str),
+        "integer": lambda value: isinstance(value, int),
+        "dict": lambda value: isinstance(value, Mapping),
+        "list": lambda value: isinstance(value, Sequence) and not isinstance(value, str)
+    }
+
+    def __init__(self, schema: Dict[str, dict]):
+        self.schema = schema
+
+    def validate(self, document: Mapping) -> dict:
+        """
+        :return: errors as a tree of nested dicts and lists like cerberus.Validator.errors, empty if the
+                 document is valid.
+        """
+        return self._validate_mapping(document, self.schema)
+
+    def _validate_mapping(self, mapping: Mapping, schema: Dict[str, dict]) -> dict:
+        errors = {}
+        for field in mapping:
+            if field == "__line__":
+                continue
+            if field not in schema:
+                errors[field] = ["unknown field"]
+                continue
+            if mapping[field] is None and "default" in schema[field]:
+                # cerberus replaces null values by the default
+                continue
+            field_errors = self._validate_value(mapping[field], schema[field])
+            if field_errors:
+                errors[field] = field_errors
+        for field, rules in schema.items():
+            if rules.get("required", True) and field not in mapping:
+                errors[field] = ["required field"]
+        return dict(sorted(errors.items()))
+
+    def _validate_value(self, value, rules: dict) -> List[Union[str, dict]]:
+        if value is None:
+            return ["null value not allowed"]
+        if "type" in rules and not ConfigValidator.TYPES[rules["type"]](value):
+            return [f"must be of {rules['type']} type"]
+        if "anyof" in rules:
+            definition_errors = {}
+            for i, definition in enumerate(rules["anyof"]):
+                errors = self._validate_value(value, definition)
+                if not errors:
+                    break
+                definition_errors[f"anyof definition {i}"] = errors
+            else:
+                return ["no definitions validate", definition_errors]
+        if "allowed" in rules and value not in rules["allowed"]:
+            return [f"unallowed value {value}"]
+        if "schema" in rules:
+            if rules.get("type") == "list":
+                item_errors = {}
+                for i, item in enumerate(value):
+                    errors = self._validate_value(item, rules["schema"])
+                    if errors:
+                        item_errors[i] = errors
+                if item_errors:
+                    return [item_errors]
+            else:
+                errors = self._validate_mapping(value, rules["schema"])
+                if errors:
+                    return [errors]
+        if "valuesrules" in rules:
+            value_errors = {}
+            for key in value:
+                if key == "__line__":
+                    continue
+                errors = self._validate_value(value[key], rules["valuesrules"])
+                if errors:
+                    value_errors[key] = errors
+            if value_errors:
+                return [dict(sorted(value_errors.items(), key=lambda item: str(item[0])))]
+        return []
+
+
+class LazyMessage:
+    """
+    Message that is rendered when it is used for the first time. This avoids the cost of rendering
+    messages that are never shown.
+    """
+    def __init__(self, render):
+        """
+        :param render: function without arguments that returns the message
+        """
+        self.render = render
+        self.message = None
+
+    def __str__(self):
+        if self.message is None:
+            self.message = self.render()
+            self.render = None
+        return self.message
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
@@ -1,12 +1,31 @@
-from typing import List
+import ipaddress
+import shlex
+from typing import List, Dict, Tuple, Union
 
 from .kubernetes import ContainerSpec
 from .PolicyTests import Port
 
 class DebugContainerSpec(ContainerSpec):
+    # prefix of the lines in the output of a batch command that delimit the output of the individual checks
+    BATCH_MARKER = "@@policytester"
+
+    # probe loop that reads lines '<id> <command>' from stdin and executes the commands.
+    AGENT_SCRIPT = "\n".join([
+        "while IFS= read -r line; do",
+        "  id=${line%% *}",
+        f"  echo \"{BATCH_MARKER} begin $id\"",
+        "  sh -c \"${line#* }\" 2>&1 </dev/null",
+        f"  echo \"{BATCH_MARKER} end $id $?\"",
+        "done"
+    ])
+
     def __init__(self,  name: str, image: str, command: List[str],
                  tcp_check_command,
-                 udp_check_command):
+                 udp_check_command,
+                 batch_check_command="{script}",
+                 check_timeout: int = 30,
+                 agent_command=AGENT_SCRIPT,
+                 resolve_command="nslookup {host}"):
         """
 
         :param name:
@@ -14,10 +33,20 @@ class DebugContainerSpec(ContainerSpec):
         :param command:
         :param tcp_check_command: command (str or array) with f-string like {host} and {port}
         :param udp_check_command: command (str or array) with f-string like {host} and {port}
+        :param batch_check_command: command (str or array) with f-string like {script} that runs
+                                    a generated shell script containing multiple checks.
+        :param check_timeout: maximum time in seconds for a single check. A check that takes longer fails.
+        :param agent_command: command (str or array) of the probe agent, see get_agent_command().
+        :param resolve_command: command (str or array) with f-string like {host} that resolves a host name.
+                                Its output is parsed by parse_resolve_output().
         """
         super().__init__(name, image, command)
         self.tcp_check_command = self._command_to_array(tcp_check_command)
         self.udp_check_command = self._command_to_array(udp_check_command)
+        self.batch_check_command = self._command_to_array(batch_check_command)
+        self.check_timeout = check_timeout
+        self.agent_command = self._command_to_array(agent_command)
+        self.resolve_command = self._command_to_array(resolve_command)
 
     def _command_to_array(self, cmd):
         if type(cmd) == str:
@@ -37,3 +66,104 @@ class DebugContainerSpec(ContainerSpec):
 
     def _format(self, cmd: str, host: str, port: int):
         return [s.format(host=host, port=port) for s in cmd]
+
+    def get_batch_command(self, checks: List[Tuple[int, str, Port]]):
+        """
+        Gets a single command that executes multiple checks.
+        :param checks: list of tuples (id, host, port)
+        :return: command that can be executed in the debug container. Its output can be parsed
+                 with parse_batch_output()
+        """
+        lines = []
+        for id, host, port in checks:
+            lines.append(f"echo '{self.BATCH_MARKER} begin {id}'")
+            lines.append(f"{shlex.join(self.get_command(host, port))} 2>&1")
+            lines.append(f"echo \"{self.BATCH_MARKER} end {id} $?\"")
+        script = "\n".join(lines)
+        return [s.format(script=script) for s in self.batch_check_command]
+
+    def parse_batch_output(self, output: str) -> Dict[int, Tuple[int, str]]:
+        """
+        Parses the output of a batch command.
+        :param output: output of the command returned by get_batch_command()
+        :return: dict of check id to tuple (exit status (int), output (str)). Checks for which no
+                 result was found in the output, for instance because of a timeout, are not included.
+        """
+        results = {}
+        parser = BatchOutputParser(self.BATCH_MARKER)
+        for line in output.splitlines():
+            result = parser.feed(line)
+            if result:
+                id, exit_status, check_output = result
+                results[id] = (exit_status, check_output)
+        return results
+
+    def get_agent_command(self) -> List[str]:
+        """
+        Gets the command of the probe agent. The agent reads requests from stdin, one per line,
+        as returned by get_agent_request(). It writes the output of each check delimited by the same
+        marker lines as the batch command, so the output can be parsed using a BatchOutputParser.
+        """
+        return self.agent_command
+
+    def get_agent_request(self, id: int, host: str, port: Port) -> str:
+        return f"{id} {shlex.join(self.get_command(host, port))}\n"
+
+    def get_resolve_command(self, host: str) -> List[str]:
+        return [s.format(host=host) for s in self.resolve_command]
+
+    def parse_resolve_output(self, output: str) -> List[str]:
+        """
+        Parses the output of nslookup. The addresses of the server that are listed before the name are skipped.
+        :return: IP addresses, IPv4 addresses first.
+        """
+        addresses = []
+        name_found = False
+        for line in output.splitlines():
+            if line.startswith("Name:"):
+                name_found = True
+            elif name_found and line.startswith("Address"):
+                # 'Address: 1.2.3.4' or 'Address 1: 1.2.3.4 hostname'
+                for field in line.split(":", 1)[1].split():
+                    try:
+                        address = ipaddress.ip_address(field)
+                    except ValueError:
+                        continue
+                    if str(address) not in addresses:
+                        addresses.append(str(address))
+                    break
+        return sorted(addresses, key=lambda address: ipaddress.ip_address(address).version)
+
+
+class BatchOutputParser:
+    """
+    Incremental parser of the output of a batch command or the probe agent.
+    """
+    def __init__(self, marker: str):
+        self.marker = marker
+        self.id = None
+        self.lines = []
+
+    def feed(self, line: str) -> Union[Tuple[int, int, str], None]:
+        """
+        Parses a line of output.
+        :return: tuple (check id, exit status, output) when the line completes the output of a check,
+                 None otherwise.
+        """
+        index = line.find(self.marker)
+        if index < 0:
+            if self.id is not None:
+                self.lines.append(line)
+            return None
+        if index > 0 and self.id is not None:
+            # output of the check that did not end with a newline
+            self.lines.append(line[:index])
+        fields = line[index:].split()
+        if len(fields) == 3 and fields[1] == "begin":
+            self.id = int(fields[2])
+            self.lines = []
+        elif len(fields) == 4 and fields[1] == "end" and self.id == int(fields[2]):
+            result = (self.id, int(fields[3]), "".join(line + "\n" for line in self.lines))
+            self.id = None
+            return result
+        return None
@@ -0,0 +1,66 @@
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Iterable
+
+from .DebugContainerSpec import DebugContainerSpec
+from .kubernetes import Pod
+
+
+class HostResolver:
+    """
+    Cache of host names resolved from within source pods, so the DNS policy of the pod applies. Each host
+    is resolved once per source pod.
+    """
+    def __init__(self, debug_container: DebugContainerSpec):
+        self.debug_container = debug_container
+        # (pod, host) -> IP addresses, empty if the host could not be resolved.
+        self.addresses: Dict[Tuple[Pod, str], List[str]] = {}
+        # (pod, host) -> output of the resolve command
+        self.outputs: Dict[Tuple[Pod, str], str] = {}
+        self.lock = threading.Lock()
+
+    def is_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def resolve_all(self, pod_hosts: Iterable[Tuple[Pod, str]], concurrency: int = 10):
+        """
+        Resolves hosts that were not resolved before. Pods are handled concurrently, but the hosts of a
+        single pod are resolved one after the other since a pod does not support concurrent exec calls.
+        :param pod_hosts: tuples (source pod, host)
+        :param concurrency: maximum number of pods for which hosts are resolved concurrently.
+        """
+        hosts_per_pod: Dict[Pod, List[str]] = {}
+        for pod, host in sorted({key for key in pod_hosts if key not in self.addresses},
+                                key=lambda key: (str(key[0]), key[1])):
+            hosts_per_pod.setdefault(pod, []).append(host)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(self.resolve_hosts, pod, hosts) for pod, hosts in hosts_per_pod.items()]:
+                future.result()
+
+    def resolve_hosts(self, pod: Pod, hosts: List[str]):
+        for host in hosts:
+            self.resolve(pod, host)
+
+    def resolve(self, pod: Pod, host: str) -> List[str]:
+        """
+        :return: IP addresses of the host as seen from the pod, empty if the host could not be resolved.
+        """
+        key = (pod, host)
+        if key in self.addresses:
+            return self.addresses[key]
+        exit_status, output = pod.exec(self.debug_container.get_resolve_command(host), self.debug_container.name,
+                                       timeoutSeconds=self.debug_container.check_timeout)
+        addresses = self.debug_container.parse_resolve_output(output) if exit_status == 0 else []
+        print(f"Resolved {host} from pod {str(pod)}: {', '.join(addresses) if addresses else 'no addresses'}")
+        with self.lock:
+            self.addresses[key] = addresses
+            self.outputs[key] = output
+        return addresses
+
+    def get_output(self, pod: Pod, host: str) -> str:
+        return self.outputs.get((pod, host), "")
@@ -0,0 +1,60 @@
+import datetime
+import xml.etree.ElementTree as ElementTree
+from typing import List, Dict
+
+from .JUnitWriter import *
+from .TestReport import *
+
+
+class JUnitMerger:
+    """
+    Merges JUnit reports written by JUnitWriter, such as the reports of the shards of a test run, into a
+    single report. Suites with the same name are combined: their cases and counts are added up, the
+    timestamp is the earliest one and the time is the longest one since shards run in parallel. The output
+    of a case is read from the system-out of its testcase element.
+    """
+
+    def __init__(self):
+        self.suites: List[TestSuite] = []
+        self.suites_by_name: Dict[str, TestSuite] = {}
+
+    def add(self, filename: str):
+        """
+        Adds the suites of a report. The cases of a suite are kept in the order in which the reports are added.
+        """
+        for element in ElementTree.parse(filename).getroot().iter("testsuite"):
+            self.add_suite(element)
+
+    def add_suite(self, element: ElementTree.Element):
+        name = element.get("name")
+        suite = self.suites_by_name.get(name)
+        timestamp = datetime.datetime.fromisoformat(element.get("timestamp"))
+        time = float(element.get("time"))
+        if suite is None:
+            suite = TestSuite(name, len(self.suites))
+            suite.time = time
+            suite.timestamp = timestamp
+            self.suites.append(suite)
+            self.suites_by_name[name] = suite
+        else:
+            suite.time = max(suite.time, time)
+            suite.timestamp = min(suite.timestamp, timestamp)
+
+        for case_element in element.findall("testcase"):
+            case = TestCase(case_element.get("name"), suite, len(suite.cases))
+            # the time of a case that was interrupted is None
+            case.time = float(case_element.get("time")) if case_element.get("time") != "None" else None
+            case.ok = case_element.find("failure") is None
+            case.cached = any(p.get("name") == "cached" and p.get("value") == "true"
+                              for p in case_element.iter("property"))
+            # the system-out is missing when the case has no output
+            case.output = case_element.findtext("system-out")
+            suite.cases.append(case)
+            suite.tests += 1
+            suite.failures += not case.ok
+
+    def write_junit(self, f):
+        writer = JUnitWriter(f)
+        for suite in self.suites:
+            writer.write_suite(suite)
+        writer.close()
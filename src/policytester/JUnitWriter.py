@@ -0,0 +1,124 @@
+import re
+import threading
+from xml.sax.saxutils import quoteattr
+
+
+class JUnitWriter:
+    """
+    Writes a JUnit XML report incrementally. Register the writer as listener of a TestReport to write each suite
+    as soon as it and all suites that were started before it have ended, so the suites are written in the order
+    in which they were started, independent of the order in which they end. The report is a valid XML document
+    after close(), also when the test run was interrupted.
+    """
+    # characters that are not allowed in XML 1.0
+    INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+    def __init__(self, f):
+        """
+        :param f: file to write to
+        """
+        self.f = f
+        self.nsuites = 0
+        self.closed = False
+        # suites end concurrently from multiple threads
+        self.lock = threading.Lock()
+        # suites that were started but not yet written in the order in which they were started, and the ones
+        # of them that have ended.
+        self.pending = []
+        self.ended = set()
+        self.f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.f.write("<testsuites>\n")
+        self.f.flush()
+
+    def case_ended(self, case, properties: dict):
+        pass
+
+    def suite_started(self, suite):
+        with self.lock:
+            self.pending.append(suite)
+
+    def suite_ended(self, suite):
+        with self.lock:
+            if suite not in self.pending:
+                # not started while the writer was listening
+                self.pending.append(suite)
+            self.ended.add(suite)
+            self._write_ended()
+
+    def _write_ended(self):
+        """
+        Writes the ended suites up to the first suite that has not ended yet.
+        """
+        while self.pending and self.pending[0] in self.ended:
+            suite = self.pending.pop(0)
+            self.ended.discard(suite)
+            if not self.closed:
+                self._write_suite(suite)
+
+    def report_finished(self, report):
+        self.close()
+
+    def write_suite(self, suite):
+        with self.lock:
+            if not self.closed:
+                self._write_suite(suite)
+
+    def _write_suite(self, suite):
+        self.nsuites += 1
+        ts = suite.timestamp.isoformat()
+        ts = re.sub("[.].*$", "", ts)
+        w = self.f.write
+        w(f"  <testsuite package='networkpolicy' name={self.attr(suite.name)} hostname='pod' id='{self.nsuites}' "
+          f"tests='{suite.tests}' failures='{suite.failures}' timestamp='{ts}' errors='0' time='{suite.time}'>\n")
+        w(f"    <properties>\n")
+        w(f"    </properties>\n")
+        for case in suite.cases:
+            w(f"    <testcase name={self.attr(case.name)} classname={self.attr(suite.id)} time='{case.time}'>\n")
+            if case.cached:
+                w(f"      <properties>\n")
+                w(f"        <property name='cached' value='true'/>\n")
+                w(f"      </properties>\n")
+            if not case.ok:
+                w(f"      <failure message='failed' type='FAIL'>\n")
+                w(f"         {self.cdata(case.output)}\n")
+                w(f"      </failure>\n")
+            # the output of each case separately so that it can be read back exactly, see JUnitMerger
+            if case.output is not None:
+                w(f"      <system-out>{self.cdata(case.output)}</system-out>\n")
+            w(f"    </testcase>\n")
+        # the output of the cases is written one case at a time instead of building a single string.
+        w(f"    <system-out><![CDATA[")
+        for case in suite.cases:
+            cached_info = " (cached)" if case.cached else ""
+            w(self.cdata_content("=" * 80 + "\n" + f"CASE {suite.name} {case.name}{cached_info}\n\n{case.output}\n\n\n"))
+        w(f"]]></system-out>\n")
+        w(f"    <system-err></system-err>\n")
+        w(f"  </testsuite>\n")
+        self.f.flush()
+
+    def close(self):
+        """
+        Finishes the report. Ended suites that wait for earlier suites that did not end are written as well.
+        Suites that end afterwards are not written.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            for suite in self.pending:
+                if suite in self.ended:
+                    self._write_suite(suite)
+            self.pending = []
+            self.ended = set()
+            self.closed = True
+            self.f.write("</testsuites>\n")
+            self.f.flush()
+
+    def attr(self, s) -> str:
+        return quoteattr(self.INVALID_XML_CHARS.sub("", str(s)))
+
+    def cdata(self, s) -> str:
+        return f"<![CDATA[{self.cdata_content(s)}]]>"
+
+    def cdata_content(self, s) -> str:
+        # ']]>' ends a CDATA section, so it is split over two sections.
+        return self.INVALID_XML_CHARS.sub("", str(s)).replace("]]>", "]]]]><![CDATA[>")
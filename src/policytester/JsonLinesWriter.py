@@ -0,0 +1,39 @@
+import json
+import threading
+
+
+class JsonLinesWriter:
+    """
+    Writes each finished case as a JSON object on a single line. Register the writer as listener of a
+    TestReport. Each line contains the properties of the case as passed to TestReport.end_case() and
+    the result of the case.
+    """
+    def __init__(self, f):
+        """
+        :param f: file to write to
+        """
+        self.f = f
+        # cases end concurrently from multiple threads
+        self.lock = threading.Lock()
+
+    def suite_started(self, suite):
+        pass
+
+    def case_ended(self, case, properties: dict):
+        record = dict(properties)
+        record.update({
+            "case": case.name,
+            "ok": case.ok,
+            "cached": case.cached,
+            "duration": case.time
+        })
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def suite_ended(self, suite):
+        pass
+
+    def report_finished(self, report):
+        pass
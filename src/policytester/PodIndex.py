@@ -0,0 +1,78 @@
+from bisect import bisect_left
+from typing import List, Dict, Tuple, Union
+
+from .kubernetes import Pod
+
+
+class PodIndex:
+    """
+    Index of a snapshot of pods for looking up pods by namespace and name prefix, or by label selector.
+    Whether a pod has a (running) debug container is determined once when the index is built, so lookups
+    do not access the API server.
+    """
+    def __init__(self, pods: List[Pod], debug_container_name: str,
+                 selected: Dict[Tuple[str, str], List[Pod]] = None):
+        """
+        :param pods: pods for lookups by namespace and name prefix
+        :param selected: pods for lookups by label selector, by (namespace, label selector). The namespace
+                         is None for pods of all namespaces.
+        """
+        # namespace -> sorted list of (name, pod)
+        self.namespaces: Dict[str, List] = {}
+        # (name, pod) of all namespaces, sorted by name and namespace
+        self.all = []
+        self.debug_container = {}
+        self.debug_container_running = {}
+        # uid -> pod, so that a pod that is found in several ways is the same object.
+        self.pods: Dict[str, Pod] = {}
+        for pod in pods:
+            pod = self.add(pod, debug_container_name)
+            self.namespaces.setdefault(pod.namespace(), []).append((pod.name(), pod))
+            self.all.append((pod.name(), pod))
+        # (namespace, label selector) -> sorted list of (name, pod)
+        self.selected: Dict[Tuple[str, str], List] = {}
+        for key, selected_pods in (selected or {}).items():
+            self.selected[key] = sorted([(pod.name(), pod)
+                                         for pod in [self.add(pod, debug_container_name) for pod in selected_pods]],
+                                        key=lambda entry: (entry[0], entry[1].namespace()))
+        for entries in self.namespaces.values():
+            entries.sort(key=lambda entry: entry[0])
+        self.all.sort(key=lambda entry: (entry[0], entry[1].namespace()))
+        self.names = {namespace: [entry[0] for entry in entries] for namespace, entries in self.namespaces.items()}
+        self.all_names = [entry[0] for entry in self.all]
+
+    def add(self, pod: Pod, debug_container_name: str) -> Pod:
+        if pod.uid() in self.pods:
+            return self.pods[pod.uid()]
+        self.pods[pod.uid()] = pod
+        self.debug_container[pod] = pod.has_ephemeral_container(debug_container_name)
+        self.debug_container_running[pod] = self.debug_container[pod] and \
+            pod.ephemeral_container_running(debug_container_name)
+        return pod
+
+    def find(self, namespace: Union[str, None], prefix: str, selector: str = None) -> List[Pod]:
+        """
+        Finds pods
+        :param namespace: namespace, None for all namespaces
+        :param prefix: prefix of the pod name
+        :param selector: label selector, the pods of the selector must have been passed to the constructor.
+        :return: pods sorted by name
+        """
+        if selector is not None:
+            return [pod for name, pod in self.selected.get((namespace, selector), []) if name.startswith(prefix)]
+        if namespace is None:
+            names, entries = self.all_names, self.all
+        else:
+            names, entries = self.names.get(namespace, []), self.namespaces.get(namespace, [])
+        res = []
+        for i in range(bisect_left(names, prefix), len(names)):
+            if not names[i].startswith(prefix):
+                break
+            res.append(entries[i][1])
+        return res
+
+    def has_debug_container(self, pod: Pod) -> bool:
+        return self.debug_container[pod]
+
+    def is_debug_container_running(self, pod: Pod) -> bool:
+        return self.debug_container_running[pod]
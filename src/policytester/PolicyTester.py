@@ -1,7 +1,18 @@
-from time import sleep
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic
 
+from .Check import *
 from .DebugContainerSpec import *
+from .HostResolver import *
+from .PodIndex import *
+from .ProbeAgent import *
+from .ReplicaSampler import *
 from .PolicyTests import *
+from .ResultStore import *
+from .Shard import *
+from .TestPlan import *
 from .TestReport import *
 from .kubernetes import *
 
@@ -10,17 +21,31 @@ class PolicyTester:
 
     def __init__(self, policy_tests: PolicyTests, cluster: Cluster, debug_container: DebugContainerSpec,
                  labelkey: str = 'policytester.instrumented',
-                 labelvalue: str = "true"):
+                 labelvalue: str = "true",
+                 result_store: ResultStore = None):
+        """
+        :param result_store: store of the results of previous runs. When set, checks that passed in the
+                             previous run and whose inputs did not change are not executed again.
+        """
         self.policy_tests = policy_tests
         self.cluster = cluster
         self.debug_container = debug_container
         self.labelkey = labelkey
         self.labelvalue = labelvalue
         self.test_report = TestReport()
+        # times (monotonic) at which pods were deleted by cleanup()
+        self.deletion_times: Dict[Pod, float] = {}
+        self.result_store = result_store
+        # fingerprints of the checks by check id, only used with a result store
+        self.fingerprints: Dict[int, str] = {}
+        # number of checks that have not ended yet by suite name, a suite ends as soon as all its checks ended
+        self.remaining_checks: Dict[str, int] = {}
+        self.remaining_checks_lock = threading.Lock()
 
-    def prepare(self) -> List[Pod]:
+    def prepare(self, concurrency: int = 10) -> List[Pod]:
         """
 
+        :param concurrency: maximum number of pods that are instrumented concurrently.
         :return: List of pods that have a debug container.
         """
         rules = self.policy_tests.rules.values()
@@ -32,30 +57,50 @@ class PolicyTester:
         for rule in rules:
             source_pods.update(rule.sources)
 
-        all_pods = self.cluster.find_pods()
+        all_pods = self.pod_index()
         eligible_pods = []
+        pods_to_instrument = []
         for source_pod in source_pods:
             print(f"Used pod ref: {source_pod}")
-            eligible_pod = self.find_eligible_pod(source_pod, all_pods)
-            print(f"Eligble pods found: {eligible_pod}")
-            if not eligible_pod:
+            replicas = self.find_eligible_pods(source_pod, all_pods)
+            print(f"Eligble pods found: {', '.join(str(pod) for pod in replicas)}")
+            if not replicas:
                 raise RuntimeError(f"Cannot find eligble pod for {str(source_pod)}")
-            eligible_pods.append(eligible_pod)
-            if not eligible_pod.has_ephemeral_container(self.debug_container.name):
-                print(f"Creating ephemeral debug container in pod {str(eligible_pod)}")
-                eligible_pod.label(self.labelkey, self.labelvalue)
-                eligible_pod.create_ephemeral_container(self.debug_container)
+            for eligible_pod in replicas:
+                if eligible_pod in eligible_pods:
+                    continue
+                eligible_pods.append(eligible_pod)
+                if not all_pods.has_debug_container(eligible_pod):
+                    pods_to_instrument.append(eligible_pod)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(self.instrument, pod) for pod in pods_to_instrument]:
+                future.result()
 
         return eligible_pods
 
+    def instrument(self, pod: Pod):
+        print(f"Creating ephemeral debug container in pod {str(pod)}")
+        pod.label(self.labelkey, self.labelvalue)
+        pod.create_ephemeral_container(self.debug_container)
+
     def wait_until_pods_deleted(self, pods: List[Pod], timeoutSeconds: int):
-        return self._wait_until_condition(pods, timeoutSeconds, lambda p: not p.is_alive())
+        """
+        Waits until pods are deleted. When the pods were deleted by cleanup(), the time it took each pod
+        to terminate is reported.
+        :return: pods that were not deleted
+        """
+        return self._wait_until_condition(pods, timeoutSeconds, lambda p: not p.is_alive(),
+                                          self.deletion_times)
 
     def wait_until_debug_container_ready(self, pods: List[Pod], timeoutSeconds: int):
         return self._wait_until_condition(pods, timeoutSeconds,
                                           lambda p: p.is_ephemeral_container_running(self.debug_container.name))
 
-    def _wait_until_condition(self, pods: List[Pod], timeoutSeconds: int, condition):
+    def _wait_until_condition(self, pods: List[Pod], timeoutSeconds: int, condition, start_times: Dict[Pod, float] = None):
+        # pods that are not in a pod cache, such as pods found by a label selector, are polled.
+        if self.cluster.caches and all(p.cache is not None for p in pods):
+            return self._wait_until_condition_watched(pods, timeoutSeconds, condition, start_times or {})
         count = timeoutSeconds
         nremaining = len(pods)+1 # force print out on first call.
         while count > 0 and pods:
@@ -73,90 +118,543 @@ class PolicyTester:
                         print("  " + str(p))
         return pods
 
-    def test(self):
-        all_pods = self.cluster.find_pods()
-        for rule in self.policy_tests.rules.values():
-            source_pods = rule.sources
+    def _wait_until_condition_watched(self, pods: List[Pod], timeoutSeconds: int, condition, start_times):
+        """
+        Waits using the pod caches of the cluster: the condition is evaluated again whenever a pod changes.
+        :param start_times: times (monotonic) from which the waiting time of a pod is reported, by default the
+                            start of waiting.
+        """
+        t0 = monotonic()
+        deadline = t0 + timeoutSeconds
+        # deleted pods no longer have a name
+        names = {p: str(p) for p in pods}
+        print(f"Waiting for {len(pods)} pods")
+        while pods:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not self.cluster.wait_for(lambda: any(condition(p) for p in pods), remaining):
+                break
+            for p in pods:
+                if condition(p):
+                    print(f"  {names[p]} after {monotonic() - start_times.get(p, t0):.1f}s")
+            pods = [p for p in pods if not condition(p)]
+        return pods
 
-            self.test_report.start_suite(f"{rule.name}.allowed")
+    def test(self, batch: bool = False, batch_size: int = 50, concurrency: int = 1, agent: bool = False,
+             rules: List[Rule] = None, resolve: bool = False, shard: Shard = None):
+        """
+        Executes the tests. Checks that test the same connection from the same source pod are
+        executed only once.
+        :param batch: execute all checks for a source pod using a single command per batch
+                      instead of one command per check.
+        :param batch_size: maximum number of checks per batch.
+        :param concurrency: maximum number of source pods from which checks are executed concurrently.
+                            The checks of a single source pod are always executed in order.
+        :param agent: execute all checks for a source pod using a probe agent in the debug container
+                      that is fed over a single exec session.
+        :param rules: rules to test, all rules by default.
+        :param resolve: resolve host names once per source pod and check the resolved address.
+        :param shard: only execute the probes of this shard, all probes by default.
+        """
+        all_pods = self.pod_index()
+        suites = self.collect_checks(all_pods, rules)
+        if shard:
+            suites = shard.select(suites)
+        if resolve:
+            self.resolve_hosts(suites)
+        self.fingerprint_checks(suites)
+
+        report_suites = self.start_suites(suites)
+        try:
+            plan = self.compile_plan(report_suites, suites)
+            if batch or agent or concurrency > 1:
+                self.test_per_source_pod(report_suites, plan, batch, batch_size, concurrency, agent)
+            else:
+                self.test_probes(report_suites, plan.probes)
+        finally:
+            self.end_remaining_suites(report_suites)
+
+        self.test_report.finish()
+
+    def start_suites(self, suites: Dict[str, List[Check]]):
+        """
+        Starts the suites of the report. A suite ends as soon as all its checks have ended, so that it
+        can be written while other suites are still running. Suites without checks end immediately.
+        :return: dict of suite name to suite of the report
+        """
+        report_suites = {suite_name: self.test_report.start_suite(suite_name) for suite_name in suites}
+        self.remaining_checks = {suite_name: len(checks) for suite_name, checks in suites.items()}
+        for suite_name, checks in suites.items():
+            if not checks:
+                self.end_suite(report_suites[suite_name])
+        return report_suites
+
+    def check_ended(self, suite):
+        """
+        Ends the suite when the last of its checks has ended.
+        """
+        with self.remaining_checks_lock:
+            if suite.name not in self.remaining_checks:
+                # the suite was already ended because the tests were interrupted
+                return
+            self.remaining_checks[suite.name] -= 1
+            ended = self.remaining_checks[suite.name] == 0
+        if ended:
+            self.end_suite(suite)
+
+    def end_suite(self, suite):
+        with self.remaining_checks_lock:
+            self.remaining_checks.pop(suite.name, None)
+        self.test_report.end_suite(suite)
+
+    def end_remaining_suites(self, report_suites):
+        """
+        Ends the suites that did not end yet because the tests were interrupted.
+        """
+        for suite_name in list(self.remaining_checks):
+            self.end_suite(report_suites[suite_name])
+
+    def compile_plan(self, report_suites, suites: Dict[str, List[Check]]) -> TestPlan:
+        """
+        Compiles the checks that must be executed into a test plan and reports contradictions.
+        """
+        checks = [check for checks in suites.values() for check in self.report_cached(report_suites, checks)]
+        plan = TestPlan(checks)
+        for message in plan.contradiction_messages():
+            print(f"CONTRADICTION: {message}")
+        print(f"Executing {len(plan.probes)} probes for {plan.nchecks} checks")
+        return plan
+
+    def test_per_source_pod(self, report_suites, plan: TestPlan, batch: bool, batch_size: int,
+                            concurrency: int, agent: bool = False):
+        """
+        Executes the probes grouped by source pod using a pool of worker threads. The test report
+        contains the cases in the same order as for sequential execution.
+        """
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            for probes in plan.probes_per_pod().values():
+                if agent:
+                    futures.append(executor.submit(self.test_agent, report_suites, probes, batch_size))
+                elif batch:
+                    futures.append(executor.submit(self.test_batches, report_suites, probes, batch_size))
+                else:
+                    futures.append(executor.submit(self.test_probes, report_suites, probes))
             try:
-                self.test_rule(source_pods, rule.allowed, True, all_pods)
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # leaving the executor waits for all submitted work, so source pods that did not start yet
+                # are cancelled to stop quickly on an error or interrupt.
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def test_probes(self, report_suites, probes: List[Probe]):
+        for probe in probes:
+            cases = self.start_cases(report_suites, probe)
+            exit_status, output = None, ""
+            try:
+                exit_status, output = self.execute_probe(probe)
             finally:
-                self.test_report.end_suite()
+                self.end_cases(cases, exit_status, output)
+
+    def test_batches(self, report_suites, probes: List[Probe], batch_size: int):
+        """
+        Executes probes of a single source pod in batches.
+        """
+        self.test_chunks(report_suites, probes, batch_size, self.execute_batch)
 
-            self.test_report.start_suite(f"{rule.name}.denied")
+    def test_agent(self, report_suites, probes: List[Probe], batch_size: int):
+        """
+        Executes probes of a single source pod using a probe agent.
+        """
+        agent = ProbeAgent(probes[0].pod, self.debug_container)
+        try:
+            self.test_chunks(report_suites, probes, batch_size, lambda chunk: self.execute_agent(agent, chunk))
+        finally:
+            agent.close()
+
+    def test_chunks(self, report_suites, probes: List[Probe], chunk_size: int, execute):
+        """
+        Executes probes in chunks.
+        :param execute: function that executes a chunk of probes and returns a dict of probe id to
+                        tuple (exit status, output)
+        """
+        for i in range(0, len(probes), chunk_size):
+            chunk = probes[i:i + chunk_size]
+            cases = [self.start_cases(report_suites, probe) for probe in chunk]
+            results = {}
             try:
-                self.test_rule(source_pods, rule.denied, False, all_pods)
+                results = execute(chunk)
             finally:
-                self.test_report.end_suite()
+                for probe, probe_cases in zip(chunk, cases):
+                    exit_status, output = results.get(probe.id, (None, ""))
+                    self.end_cases(probe_cases, exit_status, output)
+
+    async def test_async(self, batch: bool = False, batch_size: int = 50, inflight: int = 50,
+                         resolve: bool = False, shard: Shard = None):
+        """
+        Asynchronous counterpart of test() that executes probes from a single event loop.
+        :param batch: execute all checks for a source pod using a single command per batch
+                      instead of one command per check.
+        :param batch_size: maximum number of checks per batch.
+        :param inflight: maximum number of commands that are executed concurrently. Contrary to test(),
+                         checks of the same source pod may also be executed concurrently.
+        :param resolve: resolve host names once per source pod and check the resolved address.
+        :param shard: only execute the probes of this shard, all probes by default.
+        """
+        all_pods = self.pod_index()
+        suites = self.collect_checks(all_pods)
+        if shard:
+            suites = shard.select(suites)
+        if resolve:
+            self.resolve_hosts(suites)
+        self.fingerprint_checks(suites)
+
+        report_suites = self.start_suites(suites)
+        semaphore = asyncio.Semaphore(inflight)
+        try:
+            plan = self.compile_plan(report_suites, suites)
+            async with self.cluster.async_exec_session() as session:
+                if batch:
+                    tasks = [self.test_batch_async(session, semaphore, report_suites, probes[i:i + batch_size])
+                             for probes in plan.probes_per_pod().values()
+                             for i in range(0, len(probes), batch_size)]
+                else:
+                    tasks = [self.test_probe_async(session, semaphore, report_suites, probe)
+                             for probe in plan.probes]
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+        finally:
+            self.end_remaining_suites(report_suites)
 
         self.test_report.finish()
 
-    def test_rule(self, source_pods: List[SinglePodReference], connections: Connections, allowed: bool,
-                  all_pods: List[Pod]):
-        for source_pod in source_pods:
-            pod: Pod = self.find_eligible_pod(source_pod, all_pods)
-            for target in connections.connections:
-                for port in connections.connections[target]:
+    async def test_probe_async(self, session: AsyncExecSession, semaphore: asyncio.Semaphore, report_suites,
+                               probe: Probe):
+        async with semaphore:
+            cases = self.start_cases(report_suites, probe)
+            exit_status, output = None, ""
+            try:
+                exit_status, output = await self.execute_probe_async(session, probe)
+            finally:
+                self.end_cases(cases, exit_status, output)
+
+    async def test_batch_async(self, session: AsyncExecSession, semaphore: asyncio.Semaphore, report_suites,
+                               probes: List[Probe]):
+        async with semaphore:
+            cases = [self.start_cases(report_suites, probe) for probe in probes]
+            results = {}
+            try:
+                results = await self.execute_batch_async(session, probes)
+            finally:
+                for probe, probe_cases in zip(probes, cases):
+                    exit_status, output = results.get(probe.id, (None, ""))
+                    self.end_cases(probe_cases, exit_status, output)
+
+    def start_cases(self, report_suites, probe: Probe) -> List[Tuple[Check, object]]:
+        """
+        Starts the cases of all checks of a probe.
+        :return: list of tuples (check, case)
+        """
+        return [(check, self.test_report.start_case(report_suites[check.suite], check.name(), check.id))
+                for check in probe.checks]
+
+    def end_cases(self, cases: List[Tuple[Check, object]], exit_status: Union[int, None], output: str):
+        for check, case in cases:
+            self.end_case(case, check, exit_status, output)
+
+    def end_case(self, case, check: Check, exit_status: Union[int, None], output: str):
+        """
+        Ends the case of a check.
+        :param exit_status: exit status of the check, None when no result could be obtained.
+        """
+        actual_result = PolicyTester.get_actual_result(exit_status)
+        ok = actual_result == check.allowed
+        if check.resolution:
+            output = f"{check.resolution}\n{output}"
+        self.test_report.end_case(case, ok, output, properties=self.case_properties(check, actual_result, exit_status))
+        if self.result_store:
+            self.result_store.put(self.fingerprints[check.id], ok, output)
+        self.check_ended(case.test_suite)
+
+    def case_properties(self, check: Check, actual_result: Union[bool, None], exit_status: Union[int, None]):
+        """
+        :return: properties of the case of a check for report listeners.
+        """
+        return {
+            "rule": check.rule(),
+            "suite": check.suite,
+            "source": str(check.pod),
+            "target": check.target,
+            "address": check.target_address if HostResolver.is_address(check.target_address) else None,
+            "port": check.port.port,
+            "protocol": check.port.type,
+            "expected": "allowed" if check.allowed else "denied",
+            "actual": None if actual_result is None else ("allowed" if actual_result else "denied"),
+            "exit_status": exit_status
+        }
+
+    def resolve_hosts(self, suites: Dict[str, List[Check]]):
+        """
+        Resolves the host names of address targets from within the source pods, once per source pod and
+        host. The checks then use the first resolved address. When a host cannot be resolved, the check uses
+        the host name.
+        """
+        resolver = HostResolver(self.debug_container)
+        checks = [check for checks in suites.values() for check in checks
+                  if check.target_namespace is None and not HostResolver.is_address(check.target_address)]
+        resolver.resolve_all((check.pod, check.target_address) for check in checks)
+        for check in checks:
+            host = check.target_address
+            addresses = resolver.resolve(check.pod, host)
+            if addresses:
+                check.target_address = addresses[0]
+                check.resolution = f"Resolved {host} to {', '.join(addresses)}"
+            else:
+                check.resolution = f"Could not resolve {host}:\n{resolver.get_output(check.pod, host)}"
+
+    def fingerprint_checks(self, suites: Dict[str, List[Check]]):
+        """
+        Computes the fingerprints of the checks when a result store is used. The fingerprint covers the
+        source pod, the target, the command, the expected result, and the network policies in the
+        namespaces of the source and target pods.
+        """
+        self.fingerprints = {}
+        if not self.result_store:
+            return
+        checks = [check for checks in suites.values() for check in checks]
+        namespaces = {check.pod.namespace() for check in checks}
+        namespaces.update(check.target_namespace for check in checks if check.target_namespace)
+        policy_versions = self.cluster.network_policy_versions(sorted(namespaces))
+        for check in checks:
+            versions = list(policy_versions[check.pod.namespace()])
+            if check.target_namespace and check.target_namespace != check.pod.namespace():
+                versions += policy_versions[check.target_namespace]
+            self.fingerprints[check.id] = ResultStore.fingerprint(
+                check.pod.uid(), check.target_address, check.port,
+                self.debug_container.get_command(check.target_address, check.port), check.allowed, versions)
+
+    def report_cached(self, report_suites, checks: List[Check]) -> List[Check]:
+        """
+        Reports the checks that passed in the previous run with the same fingerprint.
+        :return: the checks that must be executed.
+        """
+        if not self.result_store:
+            return checks
+        remaining = []
+        for check in checks:
+            output = self.result_store.get(self.fingerprints[check.id])
+            if output is None:
+                remaining.append(check)
+                continue
+            case = self.test_report.start_case(report_suites[check.suite], check.name(), check.id)
+            properties = self.case_properties(check, check.allowed, None)
+            self.test_report.end_case(case, True, output, cached=True, properties=properties)
+            self.check_ended(case.test_suite)
+        return remaining
+
+    def collect_checks(self, all_pods: PodIndex, rules: List[Rule] = None) -> Dict[str, List[Check]]:
+        """
+        Collects the checks for the rules.
+        :param all_pods: index of all pods
+        :param rules: rules, all rules by default.
+        :return: dict of suite name to list of checks in the order in which they must be reported.
+        """
+        suites = {}
+        nchecks = 0
+        rules = list(rules if rules is not None else self.policy_tests.rules.values())
+        sampler = self.replica_sampler({source_pod for rule in rules for source_pod in rule.sources}, all_pods)
+        for rule in rules:
+            for suite, connections, allowed in [(f"{rule.name}.allowed", rule.allowed, True),
+                                                (f"{rule.name}.denied", rule.denied, False)]:
+                suites[suite] = self.collect_rule_checks(suite, rule.sources, connections, allowed, all_pods,
+                                                         nchecks, sampler)
+                nchecks += len(suites[suite])
+        return suites
+
+    def replica_sampler(self, source_pods: Iterable[SinglePodReference], all_pods: PodIndex) -> ReplicaSampler:
+        return ReplicaSampler({source_pod: self.find_eligible_pods(source_pod, all_pods)
+                               for source_pod in source_pods})
+
+    def collect_rule_checks(self, suite: str, source_pods: List[SinglePodReference], connections: Connections,
+                            allowed: bool, all_pods: PodIndex, first_id: int = 0,
+                            sampler: ReplicaSampler = None) -> List[Check]:
+        """
+        :param sampler: replicas to check from, by default the replicas that are sampled for the source pods.
+        """
+        if sampler is None:
+            sampler = self.replica_sampler(source_pods, all_pods)
+        checks = []
+        # sorted so that the checks are in the same order in every run and the sampler assigns the same
+        # replicas to the same targets, independent of the hash seed.
+        targets = [(target, sorted(connections.connections[target], key=str))
+                   for target in sorted(connections.connections)]
+        for source_pod in sorted(source_pods, key=lambda pod: pod.name):
+            for target, ports in targets:
+                for port in ports:
                     address_or_pod = connections.connections[target][port]
                     if isinstance(address_or_pod, SinglePodReference):
                         running_pod = self.find_pod_reference(address_or_pod, all_pods)
                         if running_pod:
                             target_address = running_pod.clusterIP()
-                            #print(
-                            #    f"  {str(pod):<50} {target_address:<20} {str(port):<10} {str(allowed):<10} {running_pod.namespace()}/{running_pod.name()}  ",
-                            #    end="")
                         else:
                             raise RuntimeError(f"Cannot find target pod for {str(address_or_pod)}")
+                        target_namespace = running_pod.namespace()
                     else:
-                        #print(f"  {str(pod):<50} {address_or_pod:<20} {str(port):<10} {str(allowed):<10}  ", end="")
                         target_address = address_or_pod
+                        target_namespace = None
+
+                    pod: Pod = sampler.pod(source_pod, target_address, port)
+                    checks.append(Check(first_id + len(checks), suite, pod, target, target_address, port, allowed,
+                                        target_namespace, source_pod.name))
+        return checks
+
+    def execute_probe(self, probe: Probe) -> Tuple[Union[int, None], str]:
+        """
+        :return: tuple (exit status, output). The exit status is None in case of a timeout.
+        """
+        cmd = self.debug_container.get_command(probe.target_address, probe.port)
+        return probe.pod.exec(cmd, self.debug_container.name, timeoutSeconds=self.debug_container.check_timeout)
 
-                    self.test_report.start_case(f"{pod}::{target}[{target_address}]:{port}")
-                    try:
-                        actual_result, output = PolicyTester.is_connection_allowed(
-                            self.debug_container,
-                            pod,
-                            target_address,
-                            port
-                        )
-                    finally:
-                        self.test_report.end_case(actual_result == allowed, output)
-
-    def is_connection_allowed(debug_container: DebugContainerSpec, source: Pod, target_address: str, port: Port):
-        cmd = debug_container.get_command(target_address, port)
-        exit_status, output = source.exec(cmd, debug_container.name)
-        actual_result = False if exit_status else True
-        return actual_result, output
-
-    def find_pod_reference(self, pod: SinglePodReference, all_pods) -> Union[Pod, None]:
-        pods = [p for p in all_pods if p.namespace() == pod.namespace and p.name().startswith(pod.podname)]
+    async def execute_probe_async(self, session: AsyncExecSession, probe: Probe) -> Tuple[Union[int, None], str]:
+        cmd = self.debug_container.get_command(probe.target_address, probe.port)
+        return await probe.pod.exec_async(session, cmd, self.debug_container.name,
+                                          timeoutSeconds=self.debug_container.check_timeout)
+
+    def execute_batch(self, probes: List[Probe]) -> Dict[int, Tuple[int, str]]:
+        """
+        Executes probes of the same source pod using a single command.
+        :param probes: probes to execute
+        :return: dict of probe id to tuple (exit status, output). The exit status is None
+                 when no result could be obtained for the probe.
+        """
+        pod = probes[0].pod
+        print(f"Executing {len(probes)} probes from pod {str(pod)}")
+        exit_status, output = pod.exec(self.get_batch_command(probes), self.debug_container.name,
+                                       timeoutSeconds=self.debug_container.check_timeout * len(probes))
+        return self.get_batch_results(probes, exit_status, output)
+
+    def execute_agent(self, agent: ProbeAgent, probes: List[Probe]) -> Dict[int, Tuple[int, str]]:
+        """
+        Executes probes of the same source pod using a probe agent.
+        :return: dict of probe id to tuple (exit status, output). The exit status is None
+                 when no result could be obtained for the probe.
+        """
+        agent_results = agent.run([(probe.id, probe.target_address, probe.port) for probe in probes])
+        results = {}
+        for probe in probes:
+            if probe.id in agent_results:
+                exit_status, output = agent_results[probe.id]
+                if exit_status is None:
+                    output = f"Timeout of check\n{output}"
+                results[probe.id] = (exit_status, output)
+            else:
+                results[probe.id] = (None, "No result for check, probe agent not available")
+        return results
+
+    async def execute_batch_async(self, session: AsyncExecSession, probes: List[Probe]) -> Dict[int, Tuple[int, str]]:
+        pod = probes[0].pod
+        print(f"Executing {len(probes)} probes from pod {str(pod)}")
+        exit_status, output = await pod.exec_async(session, self.get_batch_command(probes), self.debug_container.name,
+                                                   timeoutSeconds=self.debug_container.check_timeout * len(probes))
+        return self.get_batch_results(probes, exit_status, output)
+
+    def get_batch_command(self, probes: List[Probe]) -> List[str]:
+        return self.debug_container.get_batch_command(
+            [(probe.id, probe.target_address, probe.port) for probe in probes])
+
+    def get_batch_results(self, probes: List[Probe], exit_status: int, output: str) -> Dict[int, Tuple[int, str]]:
+        batch_results = self.debug_container.parse_batch_output(output)
+        results = {}
+        for probe in probes:
+            if probe.id in batch_results:
+                results[probe.id] = batch_results[probe.id]
+            else:
+                if exit_status is None:
+                    reason = "timeout of batch"
+                else:
+                    reason = f"exit status of batch {exit_status}"
+                results[probe.id] = (None, f"No result for check, {reason}\n{output}")
+        return results
+
+    def get_actual_result(exit_status: int) -> Union[bool, None]:
+        """
+        :return: whether the connection is allowed based on the exit status of the check, None in
+                 case of a timeout.
+        """
+        if exit_status is None:
+            return None
+        return exit_status == 0
+
+    def affected_rules(self, namespaces: List[str]) -> List[Rule]:
+        """
+        Determines the rules that can be affected by changes of the network policies in the given namespaces.
+        Egress policies apply in the namespace of a source pod and ingress policies in the namespace of a target
+        pod. Pods without a namespace can be in any namespace.
+        :return: affected rules in the order of the configuration.
+        """
+        namespaces = set(namespaces)
+        affected = []
+        for rule in self.policy_tests.rules.values():
+            pods = list(rule.sources)
+            for connections in [rule.allowed, rule.denied]:
+                pods += [address_or_pod for ports in connections.connections.values()
+                         for address_or_pod in ports.values() if isinstance(address_or_pod, SinglePodReference)]
+            if any(pod.namespace is None or pod.namespace in namespaces for pod in pods):
+                affected.append(rule)
+        return affected
+
+    def pod_index(self) -> PodIndex:
+        """
+        Looks up the pods that are used in the tests. Pods with a label selector are looked up by the
+        API server, once for every unique selector, instead of listing all pods of their namespace.
+        """
+        selectors = sorted({(pod.namespace, pod.selector) for pod in self.policy_tests.pods.values()
+                            if isinstance(pod, SinglePodReference) and pod.selector is not None},
+                           key=lambda key: (key[0] or "", key[1]))
+        with ThreadPoolExecutor(max_workers=Cluster.MAX_CONCURRENT_LISTS) as executor:
+            selected = dict(zip(selectors, executor.map(
+                lambda key: self.cluster.find_pods(namespace=key[0], label_selector=key[1]), selectors)))
+        return PodIndex(self.cluster.find_pods(namespaces=self.policy_tests.namespaces(selectors=False)),
+                        self.debug_container.name, selected)
+
+    def find_pod_reference(self, pod: SinglePodReference, all_pods: PodIndex) -> Union[Pod, None]:
+        pods = all_pods.find(pod.namespace, pod.podname, pod.selector)
         if pods:
             return pods[0]
         return None
 
-    def cleanup(self):
-        pods = self.cluster.find_pods()
+    def cleanup(self, concurrency: int = 10):
+        """
+        Deletes the instrumented pods.
+        :param concurrency: maximum number of pods that are deleted concurrently.
+        :return: deleted pods.
+        """
+        pods = self.cluster.find_pods(namespaces=self.policy_tests.namespaces(),
+                                      label_selector=f"{self.labelkey}={self.labelvalue}")
         pods = [p for p in pods if p.labels().get(self.labelkey, None) == self.labelvalue]
-        for pod in pods:
-            print(f"Deleting pod {pod.namespace()}/{pod.name()}")
-            pod.delete()
+        self.deletion_times = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(self.delete, pod) for pod in pods]:
+                future.result()
         return pods
 
-    def find_eligible_pod(self, source_pod: SinglePodReference, all_pods: List[Pod], debug=False) -> Pod:
-        pods = [p for p in all_pods if p.name().startswith(source_pod.podname)]
-
-        # pods with the mentioned debug container
-        debug_pods = [p for p in pods if p.has_ephemeral_container(self.debug_container.name)]
-        if debug_pods:
-            # now find a container with a running debug pod
-            working_debug_pods = [p for p in debug_pods if p.is_ephemeral_container_running(self.debug_container.name)]
-            if not working_debug_pods:
-                if debug:
-                    print(f"Pod with debug container found {str(debug_pods)} but the debug container is not running")
-                return debug_pods[0]
-            else:
-                if debug:
-                    print(f"Existing pod with debug container already running was found {str(debug_pods[0])}")
-                return working_debug_pods[0]
-        return pods[0] if pods else None
+    def delete(self, pod: Pod):
+        print(f"Deleting pod {pod.namespace()}/{pod.name()}")
+        self.deletion_times[pod] = monotonic()
+        pod.delete()
+
+    def find_eligible_pods(self, source_pod: SinglePodReference, all_pods: PodIndex) -> List[Pod]:
+        """
+        :return: the replicas of the pod reference to check from, as many as the sample of the reference.
+                 Replicas with a running debug container are preferred over replicas with a debug container
+                 that is not running, which are preferred over replicas without a debug container.
+        """
+        pods = all_pods.find(source_pod.namespace, source_pod.podname, source_pod.selector)
+        pods = [p for p in pods if all_pods.is_debug_container_running(p)] + \
+               [p for p in pods if all_pods.has_debug_container(p) and not all_pods.is_debug_container_running(p)] + \
+               [p for p in pods if not all_pods.has_debug_container(p)]
+        return pods[:source_pod.sample_size(len(pods))]
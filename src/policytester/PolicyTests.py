@@ -1,10 +1,13 @@
+import functools
+import math
 import re
-from typing import List, Set, Dict, Union
+from typing import List, Set, FrozenSet, Dict, Union
 
-import cerberus
 import yaml
 from attrdict import AttrDict
 
+from .ConfigValidator import *
+
 
 class PolicyTests:
     OPTIONAL_LIST_OF_STRINGS = {
@@ -12,6 +15,7 @@ class PolicyTests:
         "schema": {"type": "string"},
         "required": False
     }
+    SELECTOR_OPERATORS = ["In", "NotIn", "Exists", "DoesNotExist"]
     SCHEMA = {
         "pods": {
             "type": "list",
@@ -21,6 +25,26 @@ class PolicyTests:
                     "name": {"type": "string"},
                     "namespace": {"type": "string", "required": False},
                     "podname": {"type": "string", "required": False},
+                    "selector": {
+                        "type": "dict",
+                        "required": False,
+                        "schema": {
+                            "matchLabels": {"type": "dict", "required": False, "valuesrules": {"type": "string"}},
+                            "matchExpressions": {
+                                "type": "list",
+                                "required": False,
+                                "schema": {
+                                    "type": "dict",
+                                    "schema": {
+                                        "key": {"type": "string"},
+                                        "operator": {"type": "string", "allowed": SELECTOR_OPERATORS},
+                                        "values": OPTIONAL_LIST_OF_STRINGS
+                                    }
+                                }
+                            }
+                        }
+                    },
+                    "sample": {"anyof": [{"type": "integer"}, {"type": "string"}], "required": False},
                     "pods": OPTIONAL_LIST_OF_STRINGS
                 }
             }
@@ -81,16 +105,12 @@ class PolicyTests:
             if field not in self.config:
                 self.config[field] = []
 
-        v = cerberus.Validator(PolicyTests.SCHEMA, require_all=True)
-
-        v.validate(self.remove_field(self.config, "__line__"))
-        self.cerberus_errors = v.errors
+        # validation in place, ignoring the __line__ fields.
+        self.validation_errors = ConfigValidator(PolicyTests.SCHEMA).validate(self.config)
 
-        flat_errors = self.errors_to_flat_list(self.cerberus_errors)
+        flat_errors = self.errors_to_flat_list(self.validation_errors)
         self.error_messages = self.flat_list_to_messages(flat_errors)
 
-        self.normalized_data = v.document
-
         # pod names must be unique and pod must have either podname of pods element. In case of pods element, the
         # references must refer to pod names defined before.
 
@@ -102,7 +122,7 @@ class PolicyTests:
     def setup_pods(self):
         self.pods = {}
         for pod in self.config.pods:
-            if "podname" in pod:
+            if "podname" in pod or "selector" in pod:
                 # single pod
                 if "pods" in pod:
                     self.error_messages.append(
@@ -112,14 +132,25 @@ class PolicyTests:
                         self.error_messages.append(
                             f"LINE {pod['__line__']}: A pod with name '{pod.name}' already exists")
                     else:
-                        podsource = SinglePodReference(pod.name, pod.namespace, pod.podname)
+                        selector = None
+                        if pod.get("selector") is not None:
+                            selector = self.get_label_selector(f"LINE {pod['__line__']}: Pod '{pod.name}'",
+                                                               pod["selector"])
+                        sample = pod.get("sample")
+                        if sample is not None and not SinglePodReference.is_valid_sample(sample):
+                            self.error_messages.append(
+                                f"LINE {pod['__line__']}: Pod '{pod.name}' has invalid sample '{sample}', expected a "
+                                f"number of pods of at least 1 or a percentage such as '25%'")
+                            sample = None
+                        podsource = SinglePodReference(pod.name, pod.get("namespace"), pod.get("podname", ""),
+                                                       selector, sample if sample is not None else 1)
                         self.pods[pod.name] = podsource
 
             else:
                 # pod group
-                if "podname" in pod or "namespace" in pod:
+                if "podname" in pod or "namespace" in pod or "sample" in pod:
                     self.error_messages.append(
-                        f"LINE {pod['__line__']}: Pod '{pod.name}' is a pod group and may not have 'namespace' or 'podname' defined")
+                        f"LINE {pod['__line__']}: Pod '{pod.name}' is a pod group and may not have 'namespace', 'podname' or 'sample' defined")
                 if 'pods' not in pod:
                     self.error_messages.append(
                         f"LINE {pod['__line__']}: Pod '{pod.name}' expected pod group but 'pods' element is missing")
@@ -129,6 +160,51 @@ class PolicyTests:
                 podgroup = PodGroup(pod.name, podlist)
                 self.pods[pod.name] = podgroup
 
+    def get_label_selector(self, context, selector) -> str:
+        """
+        Converts a selector with matchLabels and matchExpressions to a label selector string such as
+        'app=nginx,tier in (backend,cache)'. The requirements are sorted so that equal selectors are
+        converted to the same string.
+        """
+        requirements = []
+        match_labels = selector.get("matchLabels") or {}
+        for key in match_labels:
+            if key != "__line__":
+                requirements.append(f"{key}={match_labels[key]}")
+        for expression in selector.get("matchExpressions") or []:
+            if not isinstance(expression, dict) or expression.get("operator") not in PolicyTests.SELECTOR_OPERATORS:
+                # reported by the validation
+                continue
+            key, operator, values = expression.get("key"), expression["operator"], expression.get("values") or []
+            if operator in ["In", "NotIn"]:
+                if not values:
+                    self.error_messages.append(f"{context}: selector operator {operator} for '{key}' requires values")
+                requirements.append(f"{key} {operator.lower()} ({','.join(sorted(str(v) for v in values))})")
+            else:
+                if values:
+                    self.error_messages.append(f"{context}: selector operator {operator} for '{key}' "
+                                               f"does not allow values")
+                requirements.append(key if operator == "Exists" else f"!{key}")
+        if not requirements:
+            self.error_messages.append(f"{context}: selector does not select any labels")
+        return ",".join(sorted(requirements))
+
+    def namespaces(self, selectors: bool = True) -> Union[List[str], None]:
+        """
+        :param selectors: include the namespaces of pods that are found by a label selector
+        :return: sorted list of namespaces of all pods or None if there is a pod without namespace
+        """
+        namespaces = set()
+        # pod groups consist of single pods that are also in self.pods
+        for pod in self.pods.values():
+            if isinstance(pod, SinglePodReference):
+                if pod.selector is not None and not selectors:
+                    continue
+                if pod.namespace is None:
+                    return None
+                namespaces.add(pod.namespace)
+        return sorted(namespaces)
+
     def get_pods(self, context, reference):
         if reference not in self.pods:
             self.error_messages.append(
@@ -164,7 +240,7 @@ class PolicyTests:
                         self.error_messages.append(f"LINE {address['__line__']}: address reference '{host}' not found")
                     else:
                         hostlist.update(self.addresses[host].hosts)
-                self.addresses[address.name] = Addresses(address.name, hostlist)
+                self.addresses[address.name] = Addresses(address.name, frozenset(hostlist))
 
     def setup_rules(self):
         self.rules: Dict[str, List[Union[SinglePodReference, Addresses]]] = {}
@@ -197,16 +273,22 @@ class PolicyTests:
                     self.error_messages.append(f"{context}: connection '{deny}' not found")
                 else:
                     denied.update(self.connections[deny])
-            #allowed_and_denied = allowed.intersection(denied)
-            #if allowed_and_denied:
-            #    for ad in allowed_and_denied:
-            #        self.error_messages.append(f"{context} connection '{ad}' is both allowed and denied")
-            self.rules[rule.name] = Rule(rule.name, sources, allowed, denied)
+            for ad in allowed.intersection(denied):
+                self.error_messages.append(f"{context}: connection '{ad}' is both allowed and denied")
+            self.rules[rule.name] = Rule(rule.name, frozenset(sources), allowed, denied)
 
 
 
+    def get_port(self, port, type) -> "Port":
+        # the type is converted to str because it may be of another type in an invalid config.
+        key = (port, str(type))
+        if key not in self.ports:
+            self.ports[key] = Port(port, type)
+        return self.ports[key]
+
     def setup_connections(self):
         self.connections = {}
+        self.ports: Dict[tuple, Port] = {}
 
         for connection in self.config.connections:
             if connection.name in self.connections:
@@ -226,7 +308,7 @@ class PolicyTests:
             ports = set()
             if "ports" in connection:
                 for port in connection.ports:
-                    ports.add(Port(port.port, port.type if "type" in port else "TCP"))
+                    ports.add(self.get_port(port.port, port.type if port.get("type") is not None else "TCP"))
 
             pods = set()
             for pod in connection.pods:
@@ -311,13 +393,17 @@ class PolicyTests:
             errorpath = "".join([x if type(x) == str else '[' + str(x) + ']' for x in path[:i + 1]])
             remainingpath = "".join([x if type(x) == str else '[' + str(x) + ']' for x in path[i + 1:]])
 
-            yaml_context = yaml.dump(self.remove_field(last_context_with_line_info, "__line__"))
-            yaml_context = re.sub("^", "    ", yaml_context, flags=re.MULTILINE)
-            yaml_context = "  CONTEXT: \n" + yaml_context
-            res.append(f"ERROR: line {line}: {errorpath}: '{remainingpath}': {msg}\n{yaml_context}")
+            res.append(LazyMessage(functools.partial(self.error_message, line, errorpath, remainingpath, msg,
+                                                     last_context_with_line_info)))
 
         return res
 
+    def error_message(self, line, errorpath, remainingpath, msg, context):
+        yaml_context = yaml.dump(self.remove_field(context, "__line__"))
+        yaml_context = re.sub("^", "    ", yaml_context, flags=re.MULTILINE)
+        yaml_context = "  CONTEXT: \n" + yaml_context
+        return f"ERROR: line {line}: {errorpath}: '{remainingpath}': {msg}\n{yaml_context}"
+
 
 class PodReference:
     def __init__(self, name: str):
@@ -337,29 +423,56 @@ class PodReference:
 
 
 class SinglePodReference(PodReference):
-    def __init__(self, name, namespace, podname):
+    def __init__(self, name, namespace, podname, selector: str = None, sample: Union[int, str] = 1):
+        """
+        :param podname: prefix of the pod name
+        :param selector: label selector, None to find the pod by name only
+        :param sample: number of replicas to check from, or a percentage of the replicas such as '25%'
+        """
         super().__init__(name)
         self.namespace = namespace
         self.podname = podname
+        self.selector = selector
+        self.sample = sample
 
     def pods(self) -> List:
         return [self]
 
+    def is_valid_sample(sample) -> bool:
+        if isinstance(sample, bool):
+            return False
+        if isinstance(sample, int):
+            return sample >= 1
+        match = re.fullmatch(r"\s*(\d+(\.\d*)?)\s*%\s*", str(sample))
+        return match is not None and 0 < float(match.group(1)) <= 100
+
+    def sample_size(self, nreplicas: int) -> int:
+        """
+        :return: number of replicas to check from, at least 1 and at most nreplicas unless there are no replicas.
+        """
+        if isinstance(self.sample, int):
+            size = self.sample
+        else:
+            size = math.ceil(float(self.sample.strip().rstrip("%")) * nreplicas / 100)
+        return max(min(size, nreplicas), min(1, nreplicas))
+
     def __repr__(self):
+        if self.selector is not None:
+            return f"pod: {self.name}: {self.namespace}/{self.podname}[{self.selector}]"
         return f"pod: {self.name}: {self.namespace}/{self.podname}"
 
 
 class PodGroup(PodReference):
     def __init__(self, name, pods):
         super().__init__(name)
-        self.pods = pods
+        self.members = frozenset(pods)
 
-    def pods(self) -> List[SinglePodReference]:
-        return self.pods
+    def pods(self) -> FrozenSet[SinglePodReference]:
+        return self.members
 
     def __repr__(self):
         s = f"pod: {self.name}["
-        for pod in self.pods:
+        for pod in self.members:
             s += str(pod) + ","
         s += "]"
         return s
@@ -390,51 +503,100 @@ class Addresses:
 
 
 class Port:
+    """
+    Port of a connection. Ports are interned by PolicyTests.get_port() so that equal ports of different
+    connections are the same object.
+    """
+    __slots__ = ["port", "type", "hash"]
+
     def __init__(self, port, type):
         self.port = port
         self.type = type
+        self.hash = hash(port)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, Port):
             return self.port == other.port and self.type == other.type
         else:
             return False
 
     def __hash__(self):
-        return hash(self.port)
+        return self.hash
+
+    def __getstate__(self):
+        return self.port, self.type
+
+    def __setstate__(self, state):
+        self.__init__(*state)
 
     def __repr__(self):
         return f"{self.type}:{self.port}"
 
 
 class Connections:
+    """
+    Targets and ports of a connection. The target map and the port maps of targets are shared with the
+    connections they are merged from and are only copied when they are changed (copy on write). Connections
+    must not be changed after they are referenced by another connection or rule.
+    """
     def __init__(self, name):
         self.name = name
         # self.connections[podname][port] = Pod object
         # self.connections[hostname][port] = str hostname object
         self.connections = {}
+        # whether self.connections is shared with another connection
+        self.borrowed = False
+        # targets of which the port map is shared with another connection
+        self.shared: Set[str] = set()
 
     def updatePods(self, pods, ports):
         for pod in pods:
-            if pod.name not in self.connections:
-                self.connections[pod.name] = {}
-            for port in ports:
-                self.connections[pod.name][port] = pod
+            self.add(pod.name, {port: pod for port in ports})
 
     def updateAddresses(self, addresses, ports):
         for address in addresses:
-            if address not in self.connections:
-                self.connections[address] = {}
-            for port in ports:
-                self.connections[address][port] = address
+            self.add(address, {port: address for port in ports})
 
     def update(self, connection):
-        for target in connection.connections:
-            ports = connection.connections[target].keys()
-            for port in ports:
-                if target not in self.connections:
-                    self.connections[target] = {}
-                self.connections[target][port] = connection.connections[target][port]
+        if not self.connections:
+            self.connections = connection.connections
+            self.borrowed = True
+            return
+        self.own()
+        for target, ports in connection.connections.items():
+            if target not in self.connections:
+                self.connections[target] = ports
+                self.shared.add(target)
+            else:
+                self.add(target, ports)
+
+    def own(self):
+        if self.borrowed:
+            self.connections = dict(self.connections)
+            self.shared = set(self.connections)
+            self.borrowed = False
+
+    def add(self, target, ports):
+        self.own()
+        target_ports = self.connections.get(target)
+        if target_ports is None:
+            self.connections[target] = ports
+        elif target_ports is not ports:
+            if target in self.shared:
+                target_ports = dict(target_ports)
+                self.connections[target] = target_ports
+                self.shared.discard(target)
+            target_ports.update(ports)
+
+    def intersection(self, other) -> List[str]:
+        """
+        :return: targets and ports, formatted as 'target:port', that are in both connections.
+        """
+        return [f"{target}:{str(port)}"
+                for target in self.connections if target in other.connections
+                for port in self.connections[target] if port in other.connections[target]]
 
     def __repr__(self):
         s = f"Connections {self.name}: "
@@ -458,7 +620,7 @@ class Connections:
 
 
 class Rule:
-    def __init__(self, name, sources: Set[SinglePodReference], allowed: Connections, denied: Connections):
+    def __init__(self, name, sources: FrozenSet[SinglePodReference], allowed: Connections, denied: Connections):
         self.name = name
         # pod
         self.sources = sources
@@ -0,0 +1,76 @@
+from time import monotonic
+from typing import List, Dict, Tuple, Union
+
+from .DebugContainerSpec import DebugContainerSpec, BatchOutputParser
+from .PolicyTests import Port
+from .kubernetes import Pod, ExecSession
+
+
+class ProbeAgent:
+    """
+    Probe loop that runs in the debug container of a pod for the duration of a test. Checks are sent to the
+    agent over stdin of a single exec session and results are read back line by line. When the session
+    is closed unexpectedly, a new session is started for the remaining checks.
+    """
+    def __init__(self, pod: Pod, debug_container: DebugContainerSpec, max_sessions: int = 3):
+        """
+        :param pod: pod with debug container
+        :param debug_container: debug container
+        :param max_sessions: maximum number of sessions that are started for a single run().
+        """
+        self.pod = pod
+        self.debug_container = debug_container
+        self.max_sessions = max_sessions
+        self.session: Union[ExecSession, None] = None
+
+    def _connect(self):
+        print(f"Starting probe agent in pod {str(self.pod)}")
+        self.session = self.pod.open_exec_session(self.debug_container.get_agent_command(),
+                                                  self.debug_container.name)
+
+    def run(self, checks: List[Tuple[int, str, Port]]) -> Dict[int, Tuple[int, str]]:
+        """
+        Executes checks
+        :param checks: list of tuples (id, host, port)
+        :return: dict of check id to tuple (exit status, output). The exit status is None when the check
+                 timed out and checks without result are not included.
+        """
+        results = {}
+        pending = list(checks)
+        sessions = 0
+        while pending:
+            if self.session is None or not self.session.is_open():
+                if sessions == self.max_sessions:
+                    break
+                sessions += 1
+                self._connect()
+            for id, host, port in pending:
+                self.session.write(self.debug_container.get_agent_request(id, host, port))
+
+            parser = BatchOutputParser(self.debug_container.BATCH_MARKER)
+            deadline = monotonic() + self.debug_container.check_timeout
+            while pending:
+                line = self.session.readline(deadline - monotonic())
+                if line is None:
+                    if self.session.is_open():
+                        # the current check is stuck, the agent cannot be used anymore.
+                        id = parser.id if parser.id is not None else pending[0][0]
+                        results[id] = (None, "".join(line + "\n" for line in parser.lines))
+                        pending = [check for check in pending if check[0] != id]
+                        self.close()
+                    else:
+                        print(f"Probe agent in pod {str(self.pod)} stopped")
+                        self.session = None
+                    break
+                result = parser.feed(line)
+                if result:
+                    id, exit_status, output = result
+                    results[id] = (exit_status, output)
+                    pending = [check for check in pending if check[0] != id]
+                    deadline = monotonic() + self.debug_container.check_timeout
+        return results
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
@@ -0,0 +1,38 @@
+from typing import List, Dict, Tuple
+
+from .PolicyTests import SinglePodReference, Port
+from .kubernetes import Pod
+
+
+class ReplicaSampler:
+    """
+    Spreads the checks of source pod references round-robin over the sampled replicas of each reference.
+    A connection from the same source pod reference is always checked from the same replica, so checks of
+    different rules still share a single probe. The assignment depends on the order in which connections are
+    requested, so they must be requested in the same order in every run.
+    """
+    def __init__(self, replicas: Dict[SinglePodReference, List[Pod]]):
+        """
+        :param replicas: sampled replicas by source pod reference, the order determines the round robin order.
+        """
+        self.replicas = replicas
+        # number of connections assigned per source pod reference
+        self.counts: Dict[SinglePodReference, int] = {}
+        # (source pod reference, target address, port) -> replica
+        self.assigned: Dict[Tuple[SinglePodReference, str, Port], Pod] = {}
+
+    def pod(self, source_pod: SinglePodReference, target_address: str, port: Port) -> Pod:
+        """
+        :return: replica to check the connection from, None if the source pod reference has no replicas.
+        """
+        key = (source_pod, target_address, port)
+        pod = self.assigned.get(key)
+        if pod is None:
+            replicas = self.replicas.get(source_pod)
+            if not replicas:
+                return None
+            count = self.counts.get(source_pod, 0)
+            pod = replicas[count % len(replicas)]
+            self.counts[source_pod] = count + 1
+            self.assigned[key] = pod
+        return pod
@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List, Dict, Tuple, Union
+
+
+class ResultStore:
+    """
+    Local store of the results of passed checks, keyed by a fingerprint of the inputs of the check.
+    A check with the same fingerprint as a check that passed in the previous run does not have to
+    be executed again.
+    """
+    VERSION = 1
+
+    def __init__(self, filename: str):
+        """
+        :param filename: file in which the results are stored. The file is read if it exists.
+        """
+        self.filename = filename
+        # results of the previous run, fingerprint -> output
+        self.previous: Dict[str, str] = {}
+        # results of the current run
+        self.results: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                data = json.load(f)
+            if data.get("version") == ResultStore.VERSION:
+                self.previous = data["results"]
+
+    def fingerprint(pod_uid: str, target_address: str, port, command: List[str], allowed: bool,
+                    policy_versions: List[Tuple[str, str, str]]) -> str:
+        """
+        :param pod_uid: uid of the source pod
+        :param target_address: address of the target
+        :param port: port
+        :param command: command that executes the check in the debug container
+        :param allowed: expected result
+        :param policy_versions: tuples (namespace, name, resourceVersion) of the network policies that
+                                apply to the check
+        :return: fingerprint of the check
+        """
+        data = json.dumps([pod_uid, target_address, str(port), command, allowed, sorted(policy_versions)])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, fingerprint: str) -> Union[str, None]:
+        """
+        Gets the result of a check that passed in the previous run. The result is kept for the next run.
+        :return: output of the check, None if the check did not pass in the previous run.
+        """
+        output = self.previous.get(fingerprint)
+        if output is not None:
+            with self.lock:
+                self.results[fingerprint] = output
+        return output
+
+    def put(self, fingerprint: str, ok: bool, output: str):
+        """
+        Records the result of a check. Only passed checks are kept.
+        """
+        if ok:
+            with self.lock:
+                self.results[fingerprint] = output or ""
+
+    def save(self):
+        """
+        Saves the results of the current run. Results of the previous run that were not used are dropped.
+        """
+        tmpfile = self.filename + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({"version": ResultStore.VERSION, "results": self.results}, f)
+        os.replace(tmpfile, self.filename)
@@ -11,3 +11,18 @@ class SafeLineLoader(yaml.SafeLoader):
         mapping['__line__'] = node.start_mark.line + 1
         return mapping
 
+
+if yaml.__with_libyaml__:
+    class CSafeLineLoader(yaml.CSafeLoader):
+        """
+        Same as SafeLineLoader but using the libyaml based parser, which is much faster for large files.
+        """
+        def construct_mapping(self, node, deep=False):
+            mapping = super(CSafeLineLoader, self).construct_mapping(node, deep=deep)
+            mapping['__line__'] = node.start_mark.line + 1
+            return mapping
+
+    # fastest available loader that adds line numbers
+    FastSafeLineLoader = CSafeLineLoader
+else:
+    FastSafeLineLoader = SafeLineLoader
@@ -0,0 +1,50 @@
+import re
+from typing import List, Dict
+
+from .Check import *
+
+
+class Shard:
+    """
+    Slice of the probes of a test run, so that a test run can be split over several processes. The
+    probes are sorted by source pod reference, target address and port, and shard i of n gets the i-th
+    contiguous range of them. The shards of a run are disjoint and together contain all probes, provided
+    that all processes see the same target pods. The replica that a probe is executed from is not part of
+    the key since it can differ between processes.
+    """
+    def __init__(self, index: int, count: int):
+        """
+        :param index: number of the shard, from 1 to count
+        :param count: number of shards
+        """
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    def parse(spec: str) -> "Shard":
+        """
+        :param spec: shard formatted as 'i/n'
+        """
+        match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec)
+        if not match:
+            raise ValueError(f"Invalid shard '{spec}', expected i/n")
+        return Shard(int(match.group(1)), int(match.group(2)))
+
+    def probe_key(check: Check) -> tuple:
+        return check.source, check.target_address, str(check.port.type), str(check.port.port)
+
+    def select(self, suites: Dict[str, List[Check]]) -> Dict[str, List[Check]]:
+        """
+        :param suites: checks by suite
+        :return: checks of the probes of this shard by suite. All suites are kept, also when they have no
+                 checks in this shard, so that all shards report the same suites.
+        """
+        keys = sorted({Shard.probe_key(check) for checks in suites.values() for check in checks})
+        selected = set(keys[(self.index - 1) * len(keys) // self.count:self.index * len(keys) // self.count])
+        print(f"Shard {self}: {len(selected)} of {len(keys)} probes")
+        return {suite: [check for check in checks if Shard.probe_key(check) in selected]
+                for suite, checks in suites.items()}
+
+    def __repr__(self):
+        return f"{self.index}/{self.count}"
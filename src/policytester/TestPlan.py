@@ -0,0 +1,78 @@
+from typing import List, Dict
+
+from .Check import *
+from .PolicyTests import Port
+from .kubernetes import Pod
+
+
+class Probe:
+    """
+    A unique network check from a source pod to a target address and port. A probe is executed once
+    and its result is used for all checks that need it.
+    """
+    def __init__(self, id: int, pod: Pod, target_address: str, port: Port):
+        self.id = id
+        self.pod = pod
+        self.target_address = target_address
+        self.port = port
+        # checks in the order of the rules
+        self.checks: List[Check] = []
+
+    def is_contradictory(self) -> bool:
+        """
+        :return: whether the probe is expected to be both allowed and denied.
+        """
+        return len({check.allowed for check in self.checks}) > 1
+
+    def name(self):
+        return f"{self.pod}::{self.target_address}:{self.port}"
+
+    def __repr__(self):
+        return f"Probe {self.id}: {self.name()} checks={[check.id for check in self.checks]}"
+
+
+class TestPlan:
+    """
+    Plan of the probes to execute for a list of checks. Checks of overlapping rules and pod groups that
+    test the same connection from the same source pod share a single probe.
+    """
+    def __init__(self, checks: List[Check]):
+        """
+        :param checks: checks in the order in which they must be reported.
+        """
+        self.nchecks = len(checks)
+        # probes in the order of their first check
+        self.probes: List[Probe] = []
+        probes_by_key: Dict[tuple, Probe] = {}
+        for check in checks:
+            key = (check.pod, check.target_address, check.port)
+            probe = probes_by_key.get(key)
+            if probe is None:
+                probe = Probe(len(self.probes), check.pod, check.target_address, check.port)
+                probes_by_key[key] = probe
+                self.probes.append(probe)
+            probe.checks.append(check)
+
+    def contradictions(self) -> List[Probe]:
+        """
+        :return: probes that are expected to be both allowed and denied.
+        """
+        return [probe for probe in self.probes if probe.is_contradictory()]
+
+    def probes_per_pod(self) -> Dict[Pod, List[Probe]]:
+        """
+        :return: dict of source pod to probes in the order of the plan.
+        """
+        pod_probes: Dict[Pod, List[Probe]] = {}
+        for probe in self.probes:
+            pod_probes.setdefault(probe.pod, []).append(probe)
+        return pod_probes
+
+    def contradiction_messages(self) -> List[str]:
+        messages = []
+        for probe in self.contradictions():
+            allowed = sorted({check.suite for check in probe.checks if check.allowed})
+            denied = sorted({check.suite for check in probe.checks if not check.allowed})
+            messages.append(f"{probe.name()} is both allowed ({', '.join(allowed)}) "
+                            f"and denied ({', '.join(denied)})")
+        return messages
@@ -1,105 +1,205 @@
 import sys
+import threading
 import time
-from attrdict import AttrDict
 import datetime
-import re
+import zlib
+from typing import List
+
+from .JUnitWriter import *
+
+
+class TestSuite:
+    """
+    Results of a suite. Uses slots since a report can contain many suites.
+    """
+    __slots__ = ["id", "name", "index", "tests", "failures", "time", "timestamp", "cases",
+                 "t0", "first_case_start", "last_case_end"]
+
+    def __init__(self, name: str, index: int):
+        self.id = self.name = sys.intern(name)
+        self.index = index
+        self.tests = 0
+        self.failures = 0
+        self.time = None
+        self.t0 = time.time()
+        # start of the first case and end of the last case
+        self.first_case_start = None
+        self.last_case_end = None
+        self.timestamp = datetime.datetime.now()
+        self.cases = []
+
+
+class TestCase:
+    """
+    Result of a single case. Uses slots since a report can contain a very large number of cases. Outputs
+    are stored compressed unless they are short.
+    """
+    __slots__ = ["name", "test_suite", "order", "t0", "time", "ok", "cached", "_output"]
+
+    # outputs of at least this size are compressed
+    COMPRESS_THRESHOLD = 256
+
+    def __init__(self, name: str, test_suite: TestSuite, order: int):
+        self.name = name
+        self.test_suite = test_suite
+        self.order = order
+        self.t0 = time.time()
+        self.time = None
+        self.ok = None
+        self.cached = False
+        self._output = None
+
+    @property
+    def suite(self) -> str:
+        return self.test_suite.name
+
+    @property
+    def tests(self) -> int:
+        return 1
+
+    @property
+    def failures(self) -> int:
+        return int(not self.ok)
+
+    @property
+    def output(self) -> str:
+        if isinstance(self._output, bytes):
+            return zlib.decompress(self._output).decode("utf-8", "surrogatepass")
+        return self._output
+
+    @output.setter
+    def output(self, output: str):
+        if output is not None and len(output) >= TestCase.COMPRESS_THRESHOLD:
+            self._output = zlib.compress(output.encode("utf-8", "surrogatepass"), 1)
+        else:
+            self._output = output
+
+    def as_dict(self):
+        return {"name": self.name, "suite": self.suite, "tests": self.tests, "failures": self.failures,
+                "time": self.time, "ok": self.ok, "cached": self.cached, "output": self.output}
+
 
 class TestReport:
 
-    def __init__(self, name = "NetworkPolicyTests"):
+    def __init__(self, name = "NetworkPolicyTests", max_passed_output: int = 1000):
+        """
+        :param name: name of the report
+        :param max_passed_output: maximum number of characters of output that is kept for passed cases.
+                                  The full output is kept for failed cases only.
+        """
         self.name = name
+        self.max_passed_output = max_passed_output
+        # objects with methods suite_started(suite), case_ended(case, properties), suite_ended(suite) and
+        # report_finished(report)
+        self.listeners = []
         self.clear()
 
     def clear(self):
         self.ntests = 0
         self.nfail = 0
+        self.ncached = 0
+        # failed cases as tuples (suite index, order, case)
+        self.failed = []
         self.suites = []
+        self.suites_by_name = {}
         self.t0 = time.time()
+        # cases may be started and ended concurrently from multiple threads
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
 
-    def start_suite(self, name):
+    def start_suite(self, name) -> TestSuite:
         print(f"RULE {name}")
-        self.current_suite = AttrDict()
-        self.current_suite.id = name
-        self.current_suite.name = name
-        self.current_suite.tests = self.ntests
-        self.current_suite.failures = self.nfail
-        self.current_suite.t0 = time.time()
-        self.current_suite.timestamp = datetime.datetime.now()
-        self.current_suite.cases = []
-        self.suites.append(self.current_suite)
-
-    def end_suite(self):
-        self.current_suite.tests = self.ntests - self.current_suite.tests
-        self.current_suite.failures = self.nfail - self.current_suite.failures
-        self.current_suite.time = time.time() - self.current_suite.t0
-        del self.current_suite.t0
-        print(f"  PASS={self.current_suite.tests - self.current_suite.failures} FAIL={self.current_suite.failures} TIME={self.current_suite.time}")
-
-    def start_case(self, name):
-        print(f"  CASE {name}", end="")
-        self.current_case = AttrDict()
-        self.current_case.name = name
-        self.current_case.suite = self.current_suite.name
-        self.current_case.t0 = time.time()
-        self.current_case.tests = self.ntests
-        self.current_case.failures = self.nfail
-        self.current_suite["cases"].append(self.current_case)
-
-    def end_case(self, ok: bool, output: str):
-        self.ntests += 1
-        self.nfail += not ok
-        self.current_case.tests = self.ntests - self.current_case.tests
-        self.current_case.failures = self.nfail - self.current_case.failures
-        self.current_case.time = time.time() - self.current_case.t0
-        self.current_case.ok = ok
-        self.current_case.output = output
-        del self.current_case.t0
-        print(f"  PASS={self.current_case.tests - self.current_case.failures} FAIL={self.current_case.failures} TIME={self.current_case.time}")
+        with self.lock:
+            suite = TestSuite(name, len(self.suites))
+            self.suites.append(suite)
+            self.suites_by_name[name] = suite
+        for listener in self.listeners:
+            listener.suite_started(suite)
+        return suite
 
+    def end_suite(self, suite: TestSuite):
+        with self.lock:
+            # cases are reported in order, independent of the order in which they were executed.
+            suite.cases.sort(key=lambda case: case.order)
+            if suite.cases:
+                suite.time = suite.last_case_end - suite.first_case_start
+            else:
+                suite.time = time.time() - suite.t0
+        print(f"  PASS={suite.tests - suite.failures} FAIL={suite.failures} TIME={suite.time}")
+        for listener in self.listeners:
+            listener.suite_ended(suite)
+
+    def start_case(self, suite: TestSuite, name, order=None) -> TestCase:
+        """
+        Starts a case.
+        :param suite: suite as returned by start_suite()
+        :param name: name of the case
+        :param order: position of the case in the suite. Defaults to the order in which cases are started.
+        :return: case to pass to end_case()
+        """
+        with self.lock:
+            case = TestCase(name, suite, order if order is not None else len(suite.cases))
+            suite.first_case_start = min(case.t0, suite.first_case_start or case.t0)
+            suite.cases.append(case)
+        return case
+
+    def end_case(self, case: TestCase, ok: bool, output: str, cached: bool = False, properties: dict = None):
+        """
+        Ends a case.
+        :param ok: whether the case passed
+        :param output: output of the case
+        :param cached: whether the result was taken from a previous run instead of executing the case.
+        :param properties: additional properties of the case that are passed to the listeners but not stored.
+        """
+        t1 = time.time()
+        case.time = t1 - case.t0
+        case.ok = ok
+        case.cached = cached
+        case.output = output if not ok else self.tail(output, self.max_passed_output)
+        with self.lock:
+            self.ntests += 1
+            self.nfail += not ok
+            self.ncached += cached
+            suite = case.test_suite
+            suite.tests += 1
+            suite.failures += not ok
+            suite.last_case_end = max(t1, suite.last_case_end or t1)
+            if not ok:
+                self.failed.append((suite.index, case.order, case))
+        cached_info = " CACHED" if cached else ""
+        print(f"  CASE {case.name}  PASS={case.tests - case.failures} FAIL={case.failures} TIME={case.time}{cached_info}")
+        for listener in self.listeners:
+            listener.case_ended(case, properties or {})
+
+
+    def tail(self, output: str, max_size: int) -> str:
+        if output is None or len(output) <= max_size:
+            return output
+        return f"[... {len(output) - max_size} characters truncated ...]\n" + output[-max_size:]
 
     def finish(self):
         self.time = time.time() - self.t0
-        print(f"TOTAL PASS={self.ntests} FAIL={self.nfail} TIME={self.time}")
+        cached_info = f" CACHED={self.ncached}" if self.ncached else ""
+        print(f"TOTAL PASS={self.ntests} FAIL={self.nfail} TIME={self.time}{cached_info}")
+        for listener in self.listeners:
+            listener.report_finished(self)
 
 
-    def failed_tests(self):
-        res = []
-        for suite in self.suites:
-            if not suite.failures:
-                continue
-            for case in suite.cases:
-                if case.failures:
-                    res.append(case)
-        return res
+    def failed_tests(self) -> List[TestCase]:
+        """
+        :return: failed cases in the order of the report.
+        """
+        with self.lock:
+            self.failed.sort(key=lambda failed: failed[:2])
+            return [case for _, _, case in self.failed]
 
     def write_junit(self, f):
-        original = sys.stdout
-        sys.stdout = f
-        try:
-            print(f"<testsuites>")
-            id = 0
-            for suite in self.suites:
-                systemout = ""
-                id += 1
-                ts = suite.timestamp.isoformat()
-                ts = re.sub("[.].*$", "", ts)
-                print(f"  <testsuite package='networkpolicy' name='{suite.name}' hostname='pod' id='{id}' tests='{suite.tests}' failures='{suite.failures}' timestamp='{ts}' errors='0' time='{suite.time}'>")
-                print(f"    <properties>")
-                print(f"    </properties>")
-                for case in suite.cases:
-                    print(f"    <testcase name='{case.name}' classname='{suite.id}' time='{case.time}'>")
-                    if not case.ok:
-                        print(f"      <failure message='failed' type='FAIL'>")
-                        print(f"         {self.cdata(case.output)}")
-                        print(f"      </failure>")
-                    systemout += "="*80 + "\n" + f"CASE {suite.name} {case.name}\n\n{case.output}\n\n\n"
-                    print(f"    </testcase>")
-                print(f"    <system-out>{self.cdata(systemout)}</system-out>")
-                print(f"    <system-err></system-err>")
-                print(f"  </testsuite>")
-            print("</testsuites>")
-        finally:
-            sys.stdout = original
-
-    def cdata(self, s):
-        return f"<![CDATA[{s}]]>"
+        writer = JUnitWriter(f)
+        for suite in self.suites:
+            writer.write_suite(suite)
+        writer.close()
@@ -1,4 +1,6 @@
+import asyncio
 import sys
+from contextlib import contextmanager
 from os import access, R_OK
 from os.path import isfile
 from attrdict import AttrDict # add def
@@ -9,37 +11,100 @@ from .PolicyTests import *
 from .SafeLineLoader import *
 from .DebugContainerSpec import *
 from .PolicyTester import *
+from .ResultStore import *
+from .JsonLinesWriter import *
+from .ConfigCache import *
+from .JUnitMerger import *
 
 
 
 def print_help(message=""):
+    if message:
+        print(message, file=sys.stderr)
     print("""
 Usage:
   # prepare pods for testing 
-  policytester prepare <config.yaml>
+  policytester prepare [--concurrency N] <config.yaml>
   
   # execute tests
-  policytester execute <config.yaml>
+  policytester execute [--batch] [--concurrency N] [--agent] [--async] [--inflight N] [--timeout SECONDS]
+                       [--resolve] [--jsonl FILE] [--incremental] [--store FILE] [--shard I/N]
+                       [--junit FILE] <config.yaml>
   
+  # execute tests again whenever network policies change
+  policytester watch [--batch] [--concurrency N] [--agent] [--timeout SECONDS] [--resolve]
+                     [--jsonl FILE] [--settle SECONDS] <config.yaml>
+
   # delete earlier prepared pods
-  policytester cleanup <config.yaml>
+  policytester cleanup [--concurrency N] [--timeout SECONDS] <config.yaml>
+
+  # merge the junit reports of shards
+  policytester merge [--junit FILE] <junit.xml> ...
 
 Tests network policies following the rules in the config file. Tests are done by using the 
 current kubectl context. Then using the specifications in the yaml config file, a number
 of source pods get extra debug containers from which network tests are done. Thus the tests
 are executed from the actual running pods so that the tests are representative. 
 
-For this to work, the policy tester can work in three modes: 
+For this to work, the policy tester can work in the following modes: 
 - prepare: prepares the required pods by adding the debug container if it is not already there
 - execute: performs the tests
+- watch: watches network policies and performs the tests of the rules that may be affected by a 
+  change of a network policy, until interrupted
 - cleanup: dleetes the pods to which debug containers were added in previous perpare steps. This is
   done based on a label.   
+- merge: merges the junit reports of the shards of a test run executed with --shard into a single report.
+
+Options for all modes:
+  --no-cache: do not use the cache of parsed config files. By default, a parsed config file is 
+           cached in ~/.cache/policytester, keyed by a hash of its content.
+
+Options for prepare:
+  --concurrency N: instrument at most N pods concurrently. Default 10.
+
+Options for execute:
+  --batch: execute all checks of a source pod using a single command per batch of checks instead
+           of one command per check. This greatly reduces the number of exec calls. 
+  --concurrency N: execute checks from at most N source pods concurrently. The checks of a single 
+           source pod are executed in order. Default 1. 
+  --agent: execute all checks of a source pod using a probe agent in the debug container that 
+           reads the checks from a single long lived exec session. 
+  --async: execute checks asynchronously from a single thread. Requires aiohttp.
+  --inflight N: with --async, the maximum number of commands that are executed concurrently. Default 50. 
+  --timeout SECONDS: maximum time for a single check, a check that takes longer fails. Default 30.
+  --resolve: resolve host names of addresses once per source pod from within the pod and check the 
+           resolved address instead of resolving the host name for every check. 
+  --jsonl FILE: write each finished test case as a line of JSON to FILE, use '-' for stdout. With '-', 
+           all other output is written to stderr. 
+           Lines contain rule, source, target, address, port, protocol, expected, actual, 
+           exit_status, ok, cached, and duration. 
+  --incremental: only execute checks that failed in the previous incremental run or whose source pod, 
+           target, command, or network policies changed. The other checks are reported as cached. 
+  --store FILE: with --incremental, the file with the results of the previous run. 
+           Default policytester-results.json.
+  --shard I/N: only execute the I-th of N disjoint slices of the probes, for running a test in 
+           N parallel processes. The probes are sorted by source pod reference, target and port. 
+           Every shard reports all suites. Use a different --junit file and --store file for every 
+           shard and combine the reports with merge. 
+  --junit FILE: file to write the junit report to. Default junit.xml.
+
+Options for watch:
+  --batch, --concurrency N, --agent, --timeout SECONDS, --resolve, --jsonl FILE: see execute.
+  --settle SECONDS: after a change of a network policy, wait until no more changes occur for this 
+           period before executing the tests. Default 2.
+
+Options for cleanup:
+  --concurrency N: delete at most N pods concurrently. Default 10.
+  --timeout SECONDS: maximum time to wait for the pods to be deleted. Default 60.
+
+Options for merge:
+  --junit FILE: file to write the merged junit report to. Default junit.xml.
 
     """, file=sys.stderr)
     sys.exit(1)
 
-def prepare(tester: PolicyTester):
-    podstoinstrument = tester.prepare()
+def prepare(tester: PolicyTester, options: AttrDict):
+    podstoinstrument = tester.prepare(concurrency=options.concurrency)
     pods = tester.wait_until_debug_container_ready(podstoinstrument, 60)
     if pods:
         print(f"Pods still not ready {str(pods)}")
@@ -49,24 +114,123 @@ def prepare(tester: PolicyTester):
         for pod in podstoinstrument:
             print(f"  {str(pod)}")
 
-def execute(tester: PolicyTester):
-    tester.test()
-    test_report = tester.test_report
-    failed = test_report.failed_tests()
-
-    junit_output = "junit.xml"
-    with open(junit_output, "w") as f:
-        test_report.write_junit(f)
-    print(f"Wrote: {junit_output} with test results")
+def execute(tester: PolicyTester, options: AttrDict):
+    # the pods are found at the start of the test and their state is not used afterwards.
+    tester.cluster.refresh_policy = RefreshPolicy(RefreshPolicy.MANUAL)
+    tester.debug_container.check_timeout = options.timeout
+    if options.use_async and options.agent:
+        print_help("Options --async and --agent cannot be combined")
+    if options.incremental:
+        tester.result_store = ResultStore(options.store)
+    shard = None
+    if options.shard:
+        try:
+            shard = Shard.parse(options.shard)
+        except ValueError as e:
+            print_help(str(e))
+    with junit_output(tester.test_report, options.junit), \
+            jsonl_output(tester.test_report, options.jsonl, options.jsonl_stdout):
+        if options.use_async:
+            asyncio.run(tester.test_async(batch=options.batch, inflight=options.inflight, resolve=options.resolve,
+                                          shard=shard))
+        else:
+            tester.test(batch=options.batch, concurrency=options.concurrency, agent=options.agent,
+                        resolve=options.resolve, shard=shard)
+    failed = print_failures(tester.test_report)
+    if tester.result_store:
+        tester.result_store.save()
+        print(f"Wrote: {options.store} with results of passed tests")
+    print(f"Pod refreshes skipped: {tester.cluster.refresh_policy.skipped}")
 
     if failed:
-        for fail in failed:
-            print(f"FAIL: {str(dict(fail))}")
         sys.exit(1)
 
-def cleanup(tester: PolicyTester):
-    pods = tester.cleanup()
-    pods = tester.wait_until_pods_deleted(pods, 60)
+def watch(tester: PolicyTester, options: AttrDict):
+    tester.cluster.refresh_policy = RefreshPolicy(RefreshPolicy.MANUAL)
+    tester.debug_container.check_timeout = options.timeout
+    namespaces = tester.policy_tests.namespaces()
+    policy_watch = tester.cluster.watch_network_policies(namespaces)
+    print(f"Watching network policies in namespaces: {', '.join(namespaces) if namespaces else 'all'}")
+    with jsonl_output(tester.test_report, options.jsonl, options.jsonl_stdout):
+        watch_rules(tester, options, policy_watch)
+
+def watch_rules(tester: PolicyTester, options: AttrDict, policy_watch: NetworkPolicyWatch):
+    while True:
+        changed = policy_watch.wait_for_changes(settleSeconds=options.settle)
+        print(f"Network policies changed in namespaces: {', '.join(changed)}")
+        rules = tester.affected_rules(changed)
+        if not rules:
+            print("No rules affected")
+            continue
+        print(f"Affected rules: {', '.join(rule.name for rule in rules)}")
+        tester.test_report.clear()
+        with junit_output(tester.test_report):
+            tester.test(batch=options.batch, concurrency=options.concurrency, agent=options.agent, rules=rules,
+                        resolve=options.resolve)
+        print_failures(tester.test_report)
+
+@contextmanager
+def junit_output(test_report: TestReport, filename: str = "junit.xml"):
+    """
+    Writes the junit report while the tests are executed. Suites are written as soon as they end and the
+    report is also completed when the tests are interrupted.
+    """
+    with open(filename, "w", encoding="utf-8") as f:
+        writer = JUnitWriter(f)
+        test_report.add_listener(writer)
+        try:
+            yield writer
+        finally:
+            test_report.remove_listener(writer)
+            writer.close()
+            print(f"Wrote: {filename} with test results")
+
+@contextmanager
+def jsonl_output(test_report: TestReport, filename: str, stdout=None):
+    """
+    Writes every finished case as a JSON line to the file, or to stdout if the file name is '-'.
+    Nothing is written if the file name is empty.
+    :param stdout: stream to write to if the file name is '-', sys.stdout by default.
+    """
+    if not filename:
+        yield None
+        return
+    stdout = stdout if stdout else sys.stdout
+    f = stdout if filename == "-" else open(filename, "w", encoding="utf-8")
+    writer = JsonLinesWriter(f)
+    test_report.add_listener(writer)
+    try:
+        yield writer
+    finally:
+        test_report.remove_listener(writer)
+        if f is not stdout:
+            f.close()
+
+def print_failures(test_report: TestReport):
+    """
+    :return: failed tests
+    """
+    failed = test_report.failed_tests()
+    for fail in failed:
+        print(f"FAIL: {str(fail.as_dict())}")
+    return failed
+
+def merge(filenames: List[str], options: AttrDict):
+    merger = JUnitMerger()
+    for filename in filenames:
+        merger.add(filename)
+    with open(options.junit, "w", encoding="utf-8") as f:
+        merger.write_junit(f)
+    tests = sum(suite.tests for suite in merger.suites)
+    failures = sum(suite.failures for suite in merger.suites)
+    print(f"TOTAL PASS={tests - failures} FAIL={failures}")
+    print(f"Wrote: {options.junit} with test results of {len(filenames)} reports")
+    if failures:
+        sys.exit(1)
+
+def cleanup(tester: PolicyTester, options: AttrDict):
+    pods = tester.cleanup(concurrency=options.concurrency)
+    pods = tester.wait_until_pods_deleted(pods, options.timeout)
     if pods:
         print(f"Pods still not deleted {str(pods)}")
         sys.exit(1)
@@ -77,14 +241,81 @@ def cleanup(tester: PolicyTester):
 modes = {
     "prepare": prepare,
     "execute": execute,
-    "cleanup": cleanup
+    "watch": watch,
+    "cleanup": cleanup,
+    "merge": merge
 }
 
-def parse_config(filename: str):
-    with open(filename) as f:
-        config = yaml.load(f, SafeLineLoader)
+# options per mode: option -> (attribute, default value). Options with a boolean default value are
+# flags, other options take a value that is converted to the type of the default value.
+options_per_mode = {
+    "prepare": {
+        "--concurrency": ("concurrency", 10)
+    },
+    "execute": {
+        "--batch": ("batch", False),
+        "--concurrency": ("concurrency", 1),
+        "--agent": ("agent", False),
+        "--async": ("use_async", False),
+        "--inflight": ("inflight", 50),
+        "--timeout": ("timeout", 30),
+        "--resolve": ("resolve", False),
+        "--jsonl": ("jsonl", ""),
+        "--incremental": ("incremental", False),
+        "--store": ("store", "policytester-results.json"),
+        "--shard": ("shard", ""),
+        "--junit": ("junit", "junit.xml")
+    },
+    "watch": {
+        "--batch": ("batch", False),
+        "--concurrency": ("concurrency", 1),
+        "--agent": ("agent", False),
+        "--timeout": ("timeout", 30),
+        "--resolve": ("resolve", False),
+        "--jsonl": ("jsonl", ""),
+        "--settle": ("settle", 2.0)
+    },
+    "cleanup": {
+        "--concurrency": ("concurrency", 10),
+        "--timeout": ("timeout", 60)
+    },
+    "merge": {
+        "--junit": ("junit", "junit.xml")
+    }
+}
 
-    tests = PolicyTests(config)
+# options for all modes
+common_options = {
+    "--no-cache": ("no_cache", False)
+}
+
+def parse_options(mode: str) -> AttrDict:
+    allowed_options = dict(options_per_mode[mode], **common_options)
+    options = AttrDict({attribute: default for attribute, default in allowed_options.values()})
+    while sys.argv and sys.argv[0].startswith("--"):
+        option = sys.argv.pop(0)
+        if option not in allowed_options:
+            print_help(f"Invalid option '{option}' for mode '{mode}'")
+        attribute, default = allowed_options[option]
+        if type(default) == bool:
+            options[attribute] = True
+        else:
+            if not sys.argv:
+                print_help(f"Option '{option}' requires a value")
+            value = sys.argv.pop(0)
+            try:
+                options[attribute] = type(default)(value)
+            except ValueError:
+                print_help(f"Invalid value '{value}' for option '{option}'")
+    return options
+
+def parse_config(filename: str, use_cache: bool = True):
+    if use_cache:
+        tests = ConfigCache().load(filename)
+    else:
+        with open(filename) as f:
+            config = yaml.load(f, FastSafeLineLoader)
+        tests = PolicyTests(config)
     # test without config and use lower level API.
     # tests = PolicyTests({})
 
@@ -95,7 +326,8 @@ def parse_config(filename: str):
 
 
     kubernetes.config.load_kube_config()
-    cluster = Cluster()
+    # pods with a label selector are looked up by the API server, their namespaces are not watched.
+    cluster = Cluster(watch=True, namespaces=tests.namespaces(selectors=False))
     debug_container = DebugContainerSpec(
         "debugger", "appropriate/nc", ["sh", "-c", "tail -f /dev/null"],
         tcp_check_command="nc -v -z -i 2 -w 2 {host} {port}",
@@ -112,19 +344,37 @@ def main():
         print_help()
 
     mode = sys.argv.pop(0)
-    if mode not in ["prepare", "execute", "cleanup"]:
+    if mode not in modes:
         print("2")
         print_help(f"Invalid mode '{mode}")
 
+    options = parse_options(mode)
+    # stream for '--jsonl -'. Stdout then only contains the JSON lines and all other output goes to stderr.
+    options.jsonl_stdout = sys.stdout
+    if options.get("jsonl") == "-":
+        sys.stdout = sys.stderr
+
+    if len(sys.argv) == 0:
+        print_help()
+    if mode == "merge":
+        # merge does not use a config
+        for filename in sys.argv:
+            if not (isfile(filename) and access(filename, R_OK)):
+                print_help(f"Cannot read file '{filename}")
+        merge(sys.argv, options)
+        return
     filename = sys.argv.pop(0)
     if not (isfile(filename) and access(filename, R_OK)):
         print_help(f"Cannot read file '{filename}")
-    tester = parse_config(filename)
+    tester = parse_config(filename, use_cache=not options.no_cache)
 
     if sys.argv:
         print_help()
 
-    modes[mode](tester)
+    try:
+        modes[mode](tester, options)
+    finally:
+        tester.cluster.stop()
 
 
 
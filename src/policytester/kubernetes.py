@@ -1,8 +1,17 @@
+import asyncio
 import functools
-from time import time
-from typing import List, Dict
-
-from kubernetes import client, stream
+import json
+import re
+import select
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from time import time, sleep, monotonic
+from typing import List, Dict, Tuple, Union
+from urllib.parse import urlencode
+
+from kubernetes import client, stream, watch
 from kubernetes.client import V1Pod
 from kubernetes.client.exceptions import ApiException
 
@@ -13,10 +22,391 @@ class ContainerSpec:
         self.image = image
         self.command = command
 
+def wait_readable(sock, timeoutSeconds: float):
+    """
+    Waits until a socket is readable or the timeout expires. Like the websocket client of kubernetes,
+    poll is used where available since select cannot handle file descriptors above 1024.
+    """
+    if hasattr(select, "poll"):
+        poll = select.poll()
+        poll.register(sock, select.POLLIN)
+        poll.poll(timeoutSeconds * 1000)
+    else:
+        select.select([sock], [], [], timeoutSeconds)
+
+
+class OutputBuffer:
+    """
+    Buffer for the output of a command that keeps at most max_size characters. When more output is
+    written, the oldest output is discarded.
+    """
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size
+        self.chunks = deque()
+        self.size = 0
+        self.truncated = 0
+
+    def write(self, data: str):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.max_size is not None and self.size > self.max_size:
+            excess = self.size - self.max_size
+            chunk = self.chunks.popleft()
+            if len(chunk) > excess:
+                self.chunks.appendleft(chunk[excess:])
+                discarded = excess
+            else:
+                discarded = len(chunk)
+            self.size -= discarded
+            self.truncated += discarded
+
+    def getvalue(self) -> str:
+        value = "".join(self.chunks)
+        if self.truncated:
+            return f"[... {self.truncated} characters truncated ...]\n" + value
+        return value
+
+
+class ExecSession:
+    """
+    Exec session of a long lived command. Input is written to stdin of the command and
+    output is read from stdout line by line. Output on stderr is discarded.
+    """
+    def __init__(self, res):
+        self.res = res
+        self.buffer = ""
+
+    def is_open(self) -> bool:
+        return self.res.is_open()
+
+    def write(self, data: str):
+        self.res.write_stdin(data)
+
+    def readline(self, timeoutSeconds: float) -> Union[str, None]:
+        """
+        Reads a line from stdout.
+        :return: line without newline, None if no line was read before the timeout or the session was closed.
+        """
+        deadline = monotonic() + timeoutSeconds
+        while "\n" not in self.buffer:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not self.res.is_open():
+                return None
+            if self.res.sock.sock is not None:
+                wait_readable(self.res.sock.sock, remaining)
+            self.res.update(timeout=0)
+            self.buffer += self.res.read_stdout(timeout=0)
+            self.res.read_stderr(timeout=0)
+        line, self.buffer = self.buffer.split("\n", 1)
+        return line
+
+    def close(self):
+        # the command is not waited for.
+        self.res.close(timeout=0)
+
+
+class ListWatch:
+    """
+    Lists objects and then keeps watching them from the resource version of the list in a background
+    thread. When the resource version is too old, the objects are listed again. Errors, also of listing
+    again, are retried so the thread only ends when the watch is stopped.
+    """
+    def __init__(self, list_func: functools.partial, on_list, on_event, description: str):
+        """
+        :param list_func: list method of the API with its positional arguments, such as the namespace
+        :param on_list: function that is called with the result of every list
+        :param on_event: function that is called with every watch event
+        :param description: description of the objects for thread names and error messages
+        """
+        self.list_func = list_func
+        self.on_list = on_list
+        self.on_event = on_event
+        self.description = description
+        self.resource_version = None
+        self.watch = None
+        self.thread = None
+        self.stopped = False
+
+    def list(self):
+        result = self.list_func()
+        self.on_list(result)
+        self.resource_version = result.metadata.resource_version
+
+    def start(self):
+        """
+        Starts watching in a background thread, list() must have been called before.
+        """
+        self.thread = threading.Thread(target=self._run, name=f"watch {self.description}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.watch:
+            self.watch.stop()
+
+    def _run(self):
+        relist = False
+        while not self.stopped:
+            try:
+                if relist:
+                    # resource version too old, start again with a fresh list.
+                    self.list()
+                    relist = False
+                self.watch = watch.Watch()
+                for event in self.watch.stream(self.list_func.func, *self.list_func.args,
+                                               resource_version=self.resource_version):
+                    self.on_event(event)
+                    self.resource_version = event["object"].metadata.resource_version
+            except ApiException as e:
+                if e.status == 410:
+                    relist = True
+                elif not self.stopped:
+                    print(f"Error watching {self.description}: {e.reason}")
+                    sleep(1)
+            except Exception as e:
+                if not self.stopped:
+                    print(f"Error watching {self.description}: {e}")
+                    sleep(1)
+
+
+class PodCache:
+    """
+    Informer style cache of pods. The pods are listed once and are then kept up to date by a
+    watch in a background thread. Pods are stored by UID.
+    """
+    def __init__(self, corev1: client.CoreV1Api, namespace: str = None, condition: threading.Condition = None):
+        """
+        :param corev1: API
+        :param namespace: namespace to cache, all namespaces by default.
+        :param condition: condition that is notified on every change of the cache. Can be shared between caches.
+        """
+        self.corev1 = corev1
+        self.namespace = namespace
+        self.pods: Dict[str, V1Pod] = {}
+        self.condition = condition if condition else threading.Condition()
+        self.list_watch = ListWatch(self._list_func(), self._listed, self._event, f"pods in {namespace or 'all namespaces'}")
+
+    def start(self):
+        self.list_watch.list()
+        self.list_watch.start()
+
+    def stop(self):
+        self.list_watch.stop()
+
+    def _list_func(self):
+        if self.namespace is None:
+            return functools.partial(self.corev1.list_pod_for_all_namespaces)
+        return functools.partial(self.corev1.list_namespaced_pod, self.namespace)
+
+    def _listed(self, pods):
+        with self.condition:
+            self.pods = {p.metadata.uid: p for p in pods.items}
+            self.condition.notify_all()
+
+    def _event(self, event):
+        pod = event["object"]
+        if event["type"] in ["ADDED", "MODIFIED"]:
+            self.update(pod)
+        elif event["type"] == "DELETED":
+            self.delete(pod)
+
+    def update(self, pod: V1Pod):
+        """
+        Updates a pod, unless the cache already contains a more recent version of it.
+        """
+        with self.condition:
+            cached = self.pods.get(pod.metadata.uid)
+            if cached is None or not PodCache._is_older(pod, cached):
+                self.pods[pod.metadata.uid] = pod
+                self.condition.notify_all()
+
+    def delete(self, pod: V1Pod):
+        with self.condition:
+            self.pods.pop(pod.metadata.uid, None)
+            self.condition.notify_all()
+
+    def get(self, podspec: V1Pod) -> Union[V1Pod, None]:
+        """
+        Gets the most recent version of a pod.
+        :param podspec: pod
+        :return: the cached pod if it is more recent than the given pod, the given pod if it is up to date
+                 and None if the pod was deleted.
+        """
+        with self.condition:
+            cached = self.pods.get(podspec.metadata.uid)
+            if cached is None:
+                return None
+            if cached.metadata.resource_version == podspec.metadata.resource_version:
+                return podspec
+            return cached
+
+    def list(self, namespace: str = None) -> List[V1Pod]:
+        with self.condition:
+            return [p for p in self.pods.values() if namespace is None or p.metadata.namespace == namespace]
+
+    def wait_for(self, predicate, timeoutSeconds: float):
+        """
+        Waits until predicate() is true. The predicate is evaluated after every change of the cache.
+        :return: the last result of the predicate.
+        """
+        with self.condition:
+            return self.condition.wait_for(predicate, timeoutSeconds)
+
+    def _is_older(pod: V1Pod, other: V1Pod):
+        # resource versions are opaque but in practice they are integers that increase.
+        try:
+            return int(pod.metadata.resource_version) < int(other.metadata.resource_version)
+        except (TypeError, ValueError):
+            return False
+
+
+class NetworkPolicyWatch:
+    """
+    Watches network policies and keeps track of the namespaces in which policies were added, changed,
+    or removed. The policies are listed once and are then watched in a background thread per namespace.
+    """
+    def __init__(self, networkingv1: client.NetworkingV1Api, namespaces: List[str] = None):
+        """
+        :param networkingv1: API
+        :param namespaces: namespaces to watch, all namespaces by default.
+        """
+        self.networkingv1 = networkingv1
+        self.namespaces = namespaces or [None]
+        # resource versions of the policies by (namespace, name)
+        self.policies: Dict[Tuple[str, str], str] = {}
+        # namespaces with changed policies that were not yet returned by wait_for_changes()
+        self.changed = set()
+        self.nchanges = 0
+        self.condition = threading.Condition()
+        self.list_watches = [ListWatch(self._list_func(namespace), functools.partial(self._listed, namespace),
+                                       self._event, f"network policies in {namespace or 'all namespaces'}")
+                             for namespace in self.namespaces]
+
+    def start(self):
+        for list_watch in self.list_watches:
+            list_watch.list()
+        # the initial state is not a change
+        self.changed = set()
+        for list_watch in self.list_watches:
+            list_watch.start()
+
+    def stop(self):
+        for list_watch in self.list_watches:
+            list_watch.stop()
+
+    def _list_func(self, namespace: str):
+        if namespace is None:
+            return functools.partial(self.networkingv1.list_network_policy_for_all_namespaces)
+        return functools.partial(self.networkingv1.list_namespaced_network_policy, namespace)
+
+    def _listed(self, namespace: str, policies):
+        versions = {(p.metadata.namespace, p.metadata.name): p.metadata.resource_version for p in policies.items}
+        with self.condition:
+            # policies that were deleted while not watching
+            for key in [key for key in self.policies if namespace is None or key[0] == namespace]:
+                if key not in versions:
+                    self._delete(key)
+            for key, resource_version in versions.items():
+                self._update(key, resource_version)
+
+    def _event(self, event):
+        policy = event["object"]
+        key = (policy.metadata.namespace, policy.metadata.name)
+        with self.condition:
+            if event["type"] in ["ADDED", "MODIFIED"]:
+                self._update(key, policy.metadata.resource_version)
+            elif event["type"] == "DELETED":
+                self._delete(key)
+
+    def _update(self, key: Tuple[str, str], resource_version: str):
+        if self.policies.get(key) != resource_version:
+            self.policies[key] = resource_version
+            self._changed(key[0])
+
+    def _delete(self, key: Tuple[str, str]):
+        if self.policies.pop(key, None) is not None:
+            self._changed(key[0])
+
+    def _changed(self, namespace: str):
+        self.changed.add(namespace)
+        self.nchanges += 1
+        self.condition.notify_all()
+
+    def wait_for_changes(self, settleSeconds: float = 2, timeoutSeconds: float = None) -> List[str]:
+        """
+        Waits until network policies change. A rollout usually changes multiple policies, so after the first
+        change, this waits until no more changes occur for settleSeconds.
+        :return: sorted list of namespaces in which policies were changed, empty in case of a timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.changed, timeoutSeconds):
+                return []
+            while True:
+                nchanges = self.nchanges
+                if not self.condition.wait_for(lambda: self.nchanges != nchanges, settleSeconds):
+                    break
+            changed = self.changed
+            self.changed = set()
+        return sorted(changed)
+
+
+class RefreshPolicy:
+    """
+    Determines whether a pod is refreshed before or after invoking a method of the pod:
+    - EAGER: always refresh
+    - TTL: refresh only when the pod state is older than a given number of milliseconds
+    - MANUAL: never refresh, refresh() must be called explicitly
+    The policy counts the number of refreshes that were done and skipped.
+    """
+    EAGER = "eager"
+    TTL = "ttl"
+    MANUAL = "manual"
+
+    def __init__(self, mode: str = EAGER, ttlMillis: int = 0):
+        if mode not in [RefreshPolicy.EAGER, RefreshPolicy.TTL, RefreshPolicy.MANUAL]:
+            raise ValueError(f"Invalid refresh policy '{mode}'")
+        self.mode = mode
+        self.ttlMillis = ttlMillis
+        self.refreshed = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def should_refresh(self, refreshed_at: float) -> bool:
+        """
+        :param refreshed_at: time of the last refresh of the pod
+        """
+        if self.mode == RefreshPolicy.EAGER:
+            result = True
+        elif self.mode == RefreshPolicy.TTL:
+            result = (time() - refreshed_at) * 1000 >= self.ttlMillis
+        else:
+            result = False
+        with self.lock:
+            if result:
+                self.refreshed += 1
+            else:
+                self.skipped += 1
+        return result
+
+    def __repr__(self):
+        return f"RefreshPolicy {self.mode} ttl={self.ttlMillis}ms refreshed={self.refreshed} skipped={self.skipped}"
+
+
 class Pod:
-    def __init__(self, podspec: V1Pod):
-        self.corev1 = client.CoreV1Api()
+    def __init__(self, podspec: V1Pod, cache: PodCache = None, refresh_policy: RefreshPolicy = None,
+                 corev1: client.CoreV1Api = None):
+        """
+        :param podspec: pod
+        :param cache: pod cache used for refreshing the pod. Without cache the pod is refreshed
+                      by listing it.
+        :param refresh_policy: policy for refreshing before or after invoking methods, eager by default.
+        :param corev1: API of the pod, a new CoreV1Api by default.
+        """
+        self.corev1 = corev1 if corev1 else client.CoreV1Api()
         self.podspec = podspec
+        self.cache = cache
+        self.refresh_policy = refresh_policy if refresh_policy else RefreshPolicy()
+        self.refreshed_at = time()
 
 
     def alive_only(method):
@@ -32,7 +422,8 @@ class Pod:
         @functools.wraps(method)
         def decorator(self, *args, **kwargs):
             result = method(self, *args, **kwargs)
-            self.refresh()
+            if self.refresh_policy.should_refresh(self.refreshed_at):
+                self.refresh()
             return result
 
         return decorator
@@ -40,7 +431,8 @@ class Pod:
     def refresh_before(method):
         @functools.wraps(method)
         def decorator(self, *args, **kwargs):
-            self.refresh()
+            if self.refresh_policy.should_refresh(self.refreshed_at):
+                self.refresh()
             result = method(self, *args, **kwargs)
             return result
 
@@ -58,6 +450,10 @@ class Pod:
     def namespace(self) -> str:
         return self.podspec.metadata.namespace
 
+    @alive_only
+    def uid(self) -> str:
+        return self.podspec.metadata.uid
+
     def clusterIP(self) -> str:
         return self.podspec.status.pod_ip
 
@@ -77,7 +473,6 @@ class Pod:
         return vals if vals else {}
 
     @alive_only
-    @refresh_after
     def label(self, key: str, value: str = None):
         metadata = {
             "labels": {
@@ -85,8 +480,12 @@ class Pod:
             }
         }
         body = client.V1Pod(metadata=metadata)
-        self.corev1.patch_namespaced_pod(self.name(), self.namespace(), body)
-        self.refresh()
+        podspec = self.corev1.patch_namespaced_pod(self.name(), self.namespace(), body)
+        if self.cache is not None:
+            self.cache.update(podspec)
+        # the patch returns the updated pod so a refresh is not needed.
+        self.podspec = podspec
+        self.refreshed_at = time()
 
     @alive_only
     def has_ephemeral_container(self, name: str):
@@ -96,6 +495,13 @@ class Pod:
     @refresh_before
     @alive_only
     def is_ephemeral_container_running(self, name: str):
+        return self.ephemeral_container_running(name)
+
+    @alive_only
+    def ephemeral_container_running(self, name: str):
+        """
+        Same as is_ephemeral_container_running() but uses the current state of the pod without refreshing it.
+        """
         status = self._get_ephemeral_container_status(name)
         if status:
             return status.state.running is not None
@@ -112,6 +518,10 @@ class Pod:
     def refresh(self):
         if self.podspec is None:
             return
+        self.refreshed_at = time()
+        if self.cache is not None:
+            self.podspec = self.cache.get(self.podspec)
+            return
         pods = self.corev1.list_namespaced_pod(namespace=self.namespace(),
                                                field_selector=f"metadata.name={self.name()}")
         if len(pods.items) > 1:
@@ -156,16 +566,19 @@ class Pod:
         if status != 200:
             raise RuntimeError("Could not create ephemeral container '{name}' in pod {str(self)}")
 
-    @refresh_after
-    def exec(self, command: List[str], container: str = None, timeoutSeconds: int = 1000000, debug: bool = False):
+    def exec(self, command: List[str], container: str = None, timeoutSeconds: int = 1000000, debug: bool = False,
+             max_output: int = 1000000):
         """
-        Executes a command synchronously
+        Executes a command synchronously. The pod is not refreshed since executing a command does
+        not change the pod.
         :param command: command to execute
         :param container: container in which to execute command
-        :return: tuple (exit status (int), output (str))
+        :param timeoutSeconds: maximum time for executing the command.
+        :param max_output: maximum number of characters of output to keep, older output is discarded.
+        :return: tuple (exit status (int), output (str)), exit status is None in case of a timeout
         """
 
-        output = ""
+        output = OutputBuffer(max_output)
 
         try:
             res = stream.stream(self.corev1.connect_get_namespaced_pod_exec,
@@ -176,30 +589,67 @@ class Pod:
                                 stderr=True, stdin=False,
                                 stdout=True, tty=False,
                                 _preload_content=False)
-            maxtime = time() + timeoutSeconds
-            while res.is_open() and time() < maxtime:
-                res.update(timeout=1)
-                if res.peek_stdout():
-                    out = res.read_stdout()
-                    output += out
-                    if debug:
-                        print(out, end="")
-                if res.peek_stderr():
-                    err = res.read_stderr()
-                    output += err
-                    if debug:
-                        print(err, end="")
+            deadline = monotonic() + timeoutSeconds
+            timedout = False
+            while res.is_open():
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    timedout = True
+                    break
+                # wait for data or the deadline instead of polling.
+                if res.sock.sock is not None:
+                    wait_readable(res.sock.sock, remaining)
+                res.update(timeout=0)
+                for data in [res.read_stdout(timeout=0), res.read_stderr(timeout=0)]:
+                    if data:
+                        output.write(data)
+                        if debug:
+                            print(data, end="")
+
+            if timedout:
+                # do not wait for the close handshake of a command that is still running.
+                res.close(timeout=0)
+                return (None, output.getvalue())
 
             res.close()
 
-            if time() >= maxtime:
-                return (None, output)
+            return res.returncode, output.getvalue()
+        except ApiException as e:
+            print(f"Error executing request: {e.reason}")
+            raise (e)
 
-            return res.returncode, output
+    def open_exec_session(self, command: List[str], container: str = None) -> "ExecSession":
+        """
+        Starts a long lived command with stdin, for instance an agent that reads requests from stdin.
+        :param command: command to execute
+        :param container: container in which to execute command
+        """
+        try:
+            res = stream.stream(self.corev1.connect_get_namespaced_pod_exec,
+                                self.podspec.metadata.name,
+                                self.podspec.metadata.namespace,
+                                container=container,
+                                command=command,
+                                stderr=True, stdin=True,
+                                stdout=True, tty=False,
+                                _preload_content=False)
+            return ExecSession(res)
         except ApiException as e:
             print(f"Error executing request: {e.reason}")
             raise (e)
 
+    async def exec_async(self, session: "AsyncExecSession", command: List[str], container: str = None,
+                         timeoutSeconds: int = 1000000, max_output: int = 1000000):
+        """
+        Executes a command asynchronously.
+        :param session: session obtained from Cluster.async_exec_session()
+        :param command: command to execute
+        :param container: container in which to execute command
+        :return: tuple (exit status (int), output (str)), exit status is None in case of a timeout
+        """
+        return await session.exec(self.podspec.metadata.namespace, self.podspec.metadata.name,
+                                  command, container, timeoutSeconds, max_output)
+
     @refresh_after
     def delete(self):
         self.corev1.delete_namespaced_pod(self.name(), self.namespace())
@@ -208,13 +658,251 @@ class Pod:
         return f"{self.namespace()}/{self.name()}"
 
 
+class AsyncExecSession:
+    """
+    Executes commands in pods using the exec websocket protocol of the API server from an asyncio event
+    loop, so that many commands can be executed concurrently without a thread per command.
+    Requires aiohttp.
+    Use as an async context manager.
+    """
+    PROTOCOL = "v4.channel.k8s.io"
+    STDOUT_CHANNEL = 1
+    STDERR_CHANNEL = 2
+    ERROR_CHANNEL = 3
+
+    def __init__(self, configuration: client.Configuration):
+        self.configuration = configuration
+        self.session = None
+
+    async def __aenter__(self):
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError("Asynchronous execution requires aiohttp, install with 'pip install policytester[async]'")
+        self.aiohttp = aiohttp
+        # the number of concurrent commands is limited by the caller, not by the connection pool
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session.close()
+
+    def _ssl_context(self):
+        if not self.configuration.host.startswith("https"):
+            # default checks, not used for plain connections
+            return True
+        context = ssl.create_default_context(cafile=self.configuration.ssl_ca_cert)
+        if self.configuration.cert_file:
+            context.load_cert_chain(self.configuration.cert_file, self.configuration.key_file)
+        if not self.configuration.verify_ssl:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif self.configuration.assert_hostname is False:
+            context.check_hostname = False
+        return context
+
+    def _headers(self):
+        headers = {}
+        for auth in self.configuration.auth_settings().values():
+            if auth["in"] == "header" and auth["value"]:
+                headers[auth["key"]] = auth["value"]
+        return headers
+
+    def _url(self, namespace: str, name: str, command: List[str], container: str):
+        query = [("command", c) for c in command]
+        if container:
+            query.append(("container", container))
+        query += [("stdout", "true"), ("stderr", "true"), ("stdin", "false"), ("tty", "false")]
+        url = f"{self.configuration.host}/api/v1/namespaces/{namespace}/pods/{name}/exec?{urlencode(query)}"
+        return "ws" + url[len("http"):]
+
+    async def exec(self, namespace: str, name: str, command: List[str], container: str = None,
+                   timeoutSeconds: int = 1000000, max_output: int = 1000000) -> Tuple[int, str]:
+        """
+        Executes a command
+        :param max_output: maximum number of characters of output to keep, older output is discarded.
+        :return: tuple (exit status (int), output (str)), exit status is None in case of a timeout
+        """
+        output = OutputBuffer(max_output)
+        try:
+            async with self.session.ws_connect(self._url(namespace, name, command, container),
+                                               protocols=(self.PROTOCOL,),
+                                               headers=self._headers(),
+                                               ssl=self._ssl_context()) as ws:
+                status = await asyncio.wait_for(self._read(ws, output), timeoutSeconds)
+        except asyncio.TimeoutError:
+            return None, output.getvalue()
+        except self.aiohttp.WSServerHandshakeError as e:
+            print(f"Error executing request: {e.message}")
+            raise e
+
+        return self._returncode(status), output.getvalue()
+
+    async def _read(self, ws, output: OutputBuffer):
+        """
+        Reads stdout and stderr into output until the connection is closed.
+        :return: status sent on the error channel
+        """
+        status = None
+        async for msg in ws:
+            if msg.type not in [self.aiohttp.WSMsgType.BINARY, self.aiohttp.WSMsgType.TEXT]:
+                break
+            data = msg.data if isinstance(msg.data, bytes) else msg.data.encode("utf-8")
+            if len(data) < 2:
+                continue
+            channel = data[0]
+            if channel in [self.STDOUT_CHANNEL, self.STDERR_CHANNEL]:
+                output.write(data[1:].decode("utf-8", "replace"))
+            elif channel == self.ERROR_CHANNEL:
+                status = json.loads(data[1:])
+        return status
+
+    def _returncode(self, status):
+        if status is None:
+            raise RuntimeError("Connection closed without exit status")
+        if status.get("status") == "Success":
+            return 0
+        for cause in status.get("details", {}).get("causes", []):
+            if cause.get("reason") == "ExitCode":
+                return int(cause["message"])
+        raise RuntimeError(f"Error executing command: {status.get('message')}")
+
+
+def label_selector_matches(selector: str, labels: Dict[str, str]) -> bool:
+    """
+    Matches labels against a label selector such as 'app=nginx,tier!=frontend,!canary,env,zone in (a,b)'
+    :param selector: label selector, None matches all labels
+    :param labels: labels of an object
+    """
+    labels = labels if labels else {}
+    if not selector:
+        return True
+    # commas within the value sets of set based requirements do not separate requirements.
+    for requirement in re.split(r",(?![^()]*\))", selector):
+        requirement = requirement.strip()
+        set_based = re.fullmatch(r"(\S+)\s+(in|notin)\s*\((.*)\)", requirement)
+        if set_based:
+            key, operator, values = set_based.groups()
+            values = {value.strip() for value in values.split(",")}
+            if (labels.get(key) in values) != (operator == "in"):
+                return False
+        elif "!=" in requirement:
+            key, value = [x.strip() for x in requirement.split("!=", 1)]
+            if labels.get(key) == value:
+                return False
+        elif "=" in requirement:
+            key, value = [x.strip() for x in requirement.replace("==", "=").split("=", 1)]
+            if labels.get(key) != value:
+                return False
+        elif requirement.startswith("!"):
+            if requirement[1:].strip() in labels:
+                return False
+        elif requirement not in labels:
+            return False
+    return True
+
+
 class Cluster:
-    def __init__(self):
-        self.corev1 = client.CoreV1Api()
+    # maximum number of concurrent list requests
+    MAX_CONCURRENT_LISTS = 10
+
+    def __init__(self, watch: bool = False, refresh_policy: RefreshPolicy = None, namespaces: List[str] = None,
+                 corev1_factory=None):
+        """
+        :param watch: keep a cache of the pods that is kept up to date using a watch instead of
+                      listing pods for every lookup or refresh.
+        :param refresh_policy: refresh policy for all pods that are found, eager by default.
+        :param namespaces: namespaces to watch, all namespaces by default. With an empty list, no
+                           namespaces are watched.
+        :param corev1_factory: function without arguments that creates a CoreV1Api, client.CoreV1Api by
+                               default. Every pod gets its own API since executing a command temporarily
+                               replaces the request method of the API client.
+        """
+        self.corev1_factory = corev1_factory if corev1_factory else client.CoreV1Api
+        self.corev1 = self.corev1_factory()
+        self.refresh_policy = refresh_policy if refresh_policy else RefreshPolicy()
+        # pod caches by namespace, None for all namespaces.
+        self.caches: Dict[str, PodCache] = {}
+        # notified on every change of one of the pod caches
+        self.condition = threading.Condition()
+        self.policy_watches: List[NetworkPolicyWatch] = []
+        if watch:
+            self.caches = {namespace: PodCache(self.corev1, namespace, self.condition)
+                           for namespace in (namespaces if namespaces is not None else [None])}
+            with ThreadPoolExecutor(max_workers=Cluster.MAX_CONCURRENT_LISTS) as executor:
+                list(executor.map(PodCache.start, self.caches.values()))
+
+    def stop(self):
+        for cache in self.caches.values():
+            cache.stop()
+        for policy_watch in self.policy_watches:
+            policy_watch.stop()
+
+    def watch_network_policies(self, namespaces: List[str] = None) -> NetworkPolicyWatch:
+        """
+        Starts watching network policies. The watch is stopped by stop().
+        :param namespaces: namespaces to watch, all namespaces by default.
+        """
+        policy_watch = NetworkPolicyWatch(client.NetworkingV1Api(self.corev1.api_client), namespaces)
+        self.policy_watches.append(policy_watch)
+        policy_watch.start()
+        return policy_watch
 
-    def find_pods(self, namespace=None) -> List[Pod]:
+    def wait_for(self, predicate, timeoutSeconds: float):
+        """
+        Waits until predicate() is true. The predicate is evaluated after every change of the pod
+        caches so this requires watch to be enabled.
+        :return: the last result of the predicate.
+        """
+        if not self.caches:
+            raise RuntimeError("Waiting for changes of pods requires watch to be enabled")
+        with self.condition:
+            return self.condition.wait_for(predicate, timeoutSeconds)
+
+    def async_exec_session(self) -> AsyncExecSession:
+        return AsyncExecSession(self.corev1.api_client.configuration)
+
+    def find_pods(self, namespace: str = None, namespaces: List[str] = None, label_selector: str = None) -> List[Pod]:
+        """
+        Finds pods, using the pod caches when available. Namespaces that are not cached are listed
+        concurrently.
+        :param namespace: namespace
+        :param namespaces: namespaces, all namespaces if both namespace and namespaces are not specified.
+        :param label_selector: label selector
+        """
+        if namespace is not None:
+            namespaces = [namespace]
+        elif namespaces is None:
+            namespaces = [None]
+
+        pods = []
+        uncached = []
+        for namespace in namespaces:
+            cache = self.caches.get(namespace, self.caches.get(None))
+            if cache is not None:
+                pods += [Pod(p, cache, self.refresh_policy, self.corev1_factory()) for p in cache.list(namespace)
+                         if label_selector_matches(label_selector, p.metadata.labels)]
+            else:
+                uncached.append(namespace)
+
+        with ThreadPoolExecutor(max_workers=Cluster.MAX_CONCURRENT_LISTS) as executor:
+            for podlist in executor.map(lambda ns: self._list_pods(ns, label_selector), uncached):
+                pods += [Pod(p, None, self.refresh_policy, self.corev1_factory()) for p in podlist.items]
+        return pods
+
+    def network_policy_versions(self, namespaces: List[str]) -> Dict[str, List[Tuple[str, str, str]]]:
+        """
+        Gets the resource versions of the network policies in the given namespaces.
+        :return: dict of namespace to list of tuples (namespace, name, resourceVersion)
+        """
+        networkingv1 = client.NetworkingV1Api(self.corev1.api_client)
+        namespaces = list(namespaces)
+        with ThreadPoolExecutor(max_workers=Cluster.MAX_CONCURRENT_LISTS) as executor:
+            policylists = list(executor.map(networkingv1.list_namespaced_network_policy, namespaces))
+        return {namespace: [(namespace, p.metadata.name, p.metadata.resource_version) for p in policylist.items]
+                for namespace, policylist in zip(namespaces, policylists)}
+
+    def _list_pods(self, namespace: str, label_selector: str):
         if namespace is None:
-            pods = self.corev1.list_pod_for_all_namespaces()
-        else:
-            pods = self.corev1.list_namespaced_pod(namespace)
-        return [Pod(p) for p in pods.items]
+            return self.corev1.list_pod_for_all_namespaces(label_selector=label_selector)
+        return self.corev1.list_namespaced_pod(namespace, label_selector=label_selector)
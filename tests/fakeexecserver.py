@@ -0,0 +1,91 @@
+import asyncio
+import json
+from typing import List, Dict, Tuple
+
+from aiohttp import web
+
+
+class FakeExecServer:
+    """
+    Local fake of the API server that serves the exec websocket protocol (v4.channel.k8s.io) for
+    testing AsyncExecSession. Commands are handled by a coroutine handler(namespace, name, command, container)
+    that returns a tuple (exit code, stdout, stderr). The exit code may also be an error status object
+    that is sent on the error channel as is.
+    Use as an async context manager.
+    """
+    PROTOCOL = "v4.channel.k8s.io"
+    STDOUT_CHANNEL = 1
+    STDERR_CHANNEL = 2
+    ERROR_CHANNEL = 3
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.runner = None
+        self.host = None
+        # exec requests as tuples (namespace, name, command, container, headers)
+        self.requests: List[Tuple[str, str, List[str], str, Dict[str, str]]] = []
+        self.active = 0
+        self.max_active = 0
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/api/v1/namespaces/{namespace}/pods/{name}/exec", self.exec)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.host = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.runner.cleanup()
+
+    async def exec(self, request: web.Request) -> web.WebSocketResponse:
+        namespace = request.match_info["namespace"]
+        name = request.match_info["name"]
+        command = request.query.getall("command", [])
+        container = request.query.get("container")
+        self.requests.append((namespace, name, command, container, dict(request.headers)))
+
+        ws = web.WebSocketResponse(protocols=(self.PROTOCOL,))
+        await ws.prepare(request)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        # like the API server, the connection is closed as soon as the client closes it, also while the
+        # command is still running
+        command_task = asyncio.ensure_future(self.execute(ws, namespace, name, command, container))
+        close_task = asyncio.ensure_future(ws.receive())
+        try:
+            await asyncio.wait([command_task, close_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            command_task.cancel()
+            close_task.cancel()
+            self.active -= 1
+            await ws.close()
+        return ws
+
+    async def execute(self, ws: web.WebSocketResponse, namespace: str, name: str, command: List[str], container: str):
+        status, stdout, stderr = await self.handler(namespace, name, command, container)
+        if stdout:
+            await ws.send_bytes(bytes([self.STDOUT_CHANNEL]) + stdout.encode("utf-8"))
+        if stderr:
+            await ws.send_bytes(bytes([self.STDERR_CHANNEL]) + stderr.encode("utf-8"))
+        await ws.send_bytes(bytes([self.ERROR_CHANNEL]) + json.dumps(FakeExecServer.status(status)).encode("utf-8"))
+
+    def status(exit_code) -> dict:
+        """
+        :return: status object as sent by the API server on the error channel
+        """
+        if isinstance(exit_code, dict):
+            return exit_code
+        if exit_code == 0:
+            return {"metadata": {}, "status": "Success"}
+        return {
+            "metadata": {},
+            "status": "Failure",
+            "message": f"command terminated with non-zero exit code: error executing command [...], "
+                       f"exit code {exit_code}",
+            "reason": "NonZeroExitCode",
+            "details": {"causes": [{"reason": "ExitCode", "message": str(exit_code)}]}
+        }
@@ -0,0 +1,95 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from kubernetes import client
+from kubernetes.client import V1Pod, V1ObjectMeta
+
+from fakeexecserver import FakeExecServer
+from policytester.kubernetes import AsyncExecSession, Pod
+
+
+async def run_command(namespace, name, command, container):
+    """
+    Handler of the fake server for commands of the form ['sh', '-c', 'sleep SECONDS; exit CODE'] and
+    ['echo', ...].
+    """
+    if command[0] == "echo":
+        return 0, " ".join(command[1:]) + "\n", ""
+    script = dict(part.strip().split(" ", 1) for part in command[2].split(";"))
+    await asyncio.sleep(float(script.get("sleep", 0)))
+    return int(script.get("exit", 0)), "", f"exiting with {script.get('exit', 0)}\n"
+
+
+def configuration(host: str) -> client.Configuration:
+    configuration = client.Configuration()
+    configuration.host = host
+    configuration.api_key = {"authorization": "secret"}
+    configuration.api_key_prefix = {"authorization": "Bearer"}
+    return configuration
+
+
+def execute(handler, *commands, timeoutSeconds=10, max_output=1000000):
+    """
+    Executes the commands concurrently against a fake server.
+    :return: tuple (results, server)
+    """
+    async def run():
+        async with FakeExecServer(handler) as server:
+            async with AsyncExecSession(configuration(server.host)) as session:
+                results = await asyncio.gather(*[
+                    session.exec("ns1", "pod1", command, "debugger", timeoutSeconds, max_output)
+                    for command in commands])
+        return results, server
+    return asyncio.run(run())
+
+
+def test_exit_code_and_output():
+    results, server = execute(run_command, ["echo", "hello", "world"], ["sh", "-c", "exit 3"])
+    assert results == [(0, "hello world\n"), (3, "exiting with 3\n")]
+    namespace, name, command, container, headers = server.requests[0]
+    assert (namespace, name, command, container) == ("ns1", "pod1", ["echo", "hello", "world"], "debugger")
+    assert headers["Authorization"] == "Bearer secret"
+
+
+def test_timeout():
+    t0 = monotonic()
+    results, _ = execute(run_command, ["sh", "-c", "sleep 5"], ["echo", "done"], timeoutSeconds=0.5)
+    assert results == [(None, ""), (0, "done\n")]
+    assert monotonic() - t0 < 4
+
+
+def test_output_is_bounded():
+    results, _ = execute(run_command, ["echo", "x" * 100], max_output=10)
+    exit_code, output = results[0]
+    assert exit_code == 0
+    assert output.endswith("x" * 9 + "\n")
+    assert "x" * 11 not in output
+
+
+def test_error_without_exit_code():
+    async def handler(namespace, name, command, container):
+        return {"metadata": {}, "status": "Failure", "message": "container not found"}, "", ""
+
+    with pytest.raises(RuntimeError, match="container not found"):
+        execute(handler, ["echo"])
+
+
+def test_concurrent_streams():
+    n = 200
+    t0 = monotonic()
+    results, server = execute(run_command, *[["sh", "-c", f"sleep 0.5; exit {i % 4}"] for i in range(n)])
+    assert [exit_code for exit_code, _ in results] == [i % 4 for i in range(n)]
+    # more than the 100 connections of the default connection pool of aiohttp
+    assert server.max_active > 100
+    assert monotonic() - t0 < 0.5 * n / 10
+
+
+def test_pod_exec_async():
+    async def run():
+        async with FakeExecServer(run_command) as server:
+            pod = Pod(V1Pod(metadata=V1ObjectMeta(name="pod2", namespace="ns2")), corev1=client.CoreV1Api())
+            async with AsyncExecSession(configuration(server.host)) as session:
+                return await pod.exec_async(session, ["sh", "-c", "exit 1"], "debugger", timeoutSeconds=10)
+
+    assert asyncio.run(run()) == (1, "exiting with 1\n")
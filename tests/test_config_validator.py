@@ -0,0 +1,117 @@
+import pytest
+import yaml
+
+from policytester.ConfigValidator import ConfigValidator
+from policytester.PolicyTests import PolicyTests
+from policytester.SafeLineLoader import SafeLineLoader
+
+VALID = """
+pods:
+  - name: a
+    namespace: ns
+    podname: a-
+  - name: web
+    namespace: ns
+    selector:
+      matchLabels:
+        app: web
+      matchExpressions:
+        - key: tier
+          operator: In
+          values: [frontend]
+    sample: 2
+  - name: all
+    pods: [a, web]
+addresses:
+  - name: internet
+    hosts: [example.org]
+connections:
+  - name: http
+    pods: [web]
+    addresses: [internet]
+    ports:
+      - port: 80
+      - port: 53
+        type: UDP
+rules:
+  - name: r1
+    from: [a]
+    allowed: [http]
+    denied: []
+"""
+
+# config -> errors as reported by cerberus with require_all=True for the same schema. Sections that are
+# not in the config are added as empty lists.
+CASES = {
+    "valid": (VALID, {}),
+    "missing name": (
+        "pods:\n  - namespace: ns\n",
+        {"pods": [{0: [{"name": ["required field"]}]}]}),
+    "unknown fields": (
+        "foo: 1\npods:\n  - name: a\n    bar: x\n",
+        {"foo": ["unknown field"], "pods": [{0: [{"bar": ["unknown field"]}]}]}),
+    "wrong type": (
+        "pods: x\nrules: {}\n",
+        {"pods": ["must be of list type"], "rules": ["must be of list type"]}),
+    "unallowed port type": (
+        "connections:\n  - name: c\n    ports:\n      - port: 80\n        type: XX\n",
+        {"connections": [{0: [{"ports": [{0: [{"type": ["unallowed value XX"]}]}]}]}]}),
+    "null port type": (
+        "connections:\n  - name: c\n    ports:\n      - port: 80\n        type:\n",
+        {}),
+    "host not a string": (
+        "addresses:\n  - name: n\n    hosts: [1, x, [y]]\n",
+        {"addresses": [{0: [{"hosts": [{0: ["must be of string type"], 2: ["must be of string type"]}]}]}]}),
+    "null name": (
+        "pods:\n  - name:\n",
+        {"pods": [{0: [{"name": ["null value not allowed"]}]}]}),
+    "sample not integer or string": (
+        "pods:\n  - name: a\n    podname: a\n    sample: 1.5\n",
+        {"pods": [{0: [{"sample": ["no definitions validate",
+                                   {"anyof definition 0": ["must be of integer type"],
+                                    "anyof definition 1": ["must be of string type"]}]}]}]}),
+    "label value not a string": (
+        "pods:\n  - name: a\n    selector:\n      matchLabels:\n        app: 1\n        tier: [x]\n",
+        {"pods": [{0: [{"selector": [{"matchLabels": [{"app": ["must be of string type"],
+                                                       "tier": ["must be of string type"]}]}]}]}]}),
+    "unallowed selector operator": (
+        "pods:\n  - name: a\n    selector:\n      matchExpressions:\n        - key: k\n          operator: Has\n",
+        {"pods": [{0: [{"selector": [{"matchExpressions": [{0: [{"operator": ["unallowed value Has"]}]}]}]}]}]}),
+    "list item not a dict": (
+        "rules:\n  - x\n  - name: r\n    from: a\n    allowed: []\n    denied: []\n",
+        {"rules": [{0: ["must be of dict type"], 1: [{"from": ["must be of list type"]}]}]}),
+}
+
+
+def load(config: str) -> dict:
+    for section in ["pods", "addresses", "connections", "rules"]:
+        if not any(line.startswith(section + ":") for line in config.splitlines()):
+            config += f"{section}: []\n"
+    return yaml.load(config, SafeLineLoader)
+
+
+@pytest.mark.parametrize("config, expected", CASES.values(), ids=CASES.keys())
+def test_errors_match_cerberus(config, expected):
+    errors = ConfigValidator(PolicyTests.SCHEMA).validate(load(config))
+    assert errors == expected
+    # cerberus reports fields in sorted order
+    assert repr(errors) == repr(expected)
+
+
+def test_missing_section():
+    errors = ConfigValidator(PolicyTests.SCHEMA).validate(yaml.load("pods: []\naddresses: []\n", SafeLineLoader))
+    assert errors == {"connections": ["required field"], "rules": ["required field"]}
+
+
+def test_error_messages():
+    tests = PolicyTests(load(CASES["unallowed port type"][0]))
+    assert [str(message) for message in tests.error_messages] == [
+        "ERROR: line 4: connections[0]ports[0]: 'type': unallowed value XX\n"
+        "  CONTEXT: \n    port: 80\n    type: XX\n    "
+    ]
+
+
+def test_valid_config():
+    tests = PolicyTests(load(VALID))
+    assert tests.error_messages == []
+    assert sorted(tests.pods) == ["a", "all", "web"]
@@ -0,0 +1,74 @@
+import io
+
+from policytester.JUnitMerger import JUnitMerger
+# imported under another name so that pytest does not collect it as a test class
+from policytester.TestReport import TestReport as Report
+
+# cases of a test run by suite as tuples (name, ok, output, cached)
+CASES = {
+    "r1.allowed": [
+        ("ns/a-1::ns/b-1:TCP:80", True, "connected", False),
+        ("ns/a-1::ns/b-1:UDP:53", False, "line\n" + "=" * 80 + "\nCASE r1.allowed x\n\nmore\n\n\n", False),
+        ("ns/a-1::ns/c-1:TCP:80", True, None, True),
+        ("ns/a-1::ns/c-1:UDP:53", False, "]]> <&> é", False),
+    ],
+    "r1.denied": [],
+    "r2.allowed": [
+        ("ns/a-1::example.org[example.org]:TCP:443", True, "", False),
+        ("ns/a-1::example.org[example.org]:TCP:80", False, "  timeout  \n", True),
+    ],
+}
+
+
+def report(shard: int = None, count: int = None) -> Report:
+    """
+    :return: report of all cases, or of the cases of shard i of n. Like with --shard, all shards report
+             all suites and shard i gets the i-th contiguous range of the cases.
+    """
+    test_report = Report()
+    for suite_name, cases in CASES.items():
+        suite = test_report.start_suite(suite_name)
+        if shard is not None:
+            cases = cases[(shard - 1) * len(cases) // count:shard * len(cases) // count]
+        for name, ok, output, cached in cases:
+            test_report.end_case(test_report.start_case(suite, name), ok, output, cached)
+        test_report.end_suite(suite)
+    test_report.finish()
+    return test_report
+
+
+def merge(*reports: Report) -> JUnitMerger:
+    merger = JUnitMerger()
+    for test_report in reports:
+        f = io.StringIO()
+        test_report.write_junit(f)
+        f.seek(0)
+        merger.add(f)
+    return merger
+
+
+def summary(merger: JUnitMerger) -> list:
+    """
+    :return: suites and cases without the times, which differ between runs
+    """
+    return [(suite.name, suite.tests, suite.failures,
+             [dict(case.as_dict(), time=None) for case in suite.cases])
+            for suite in merger.suites]
+
+
+def test_merged_shards_equal_single_run():
+    single = report()
+    merged = merge(report(1, 2), report(2, 2))
+    assert summary(merged) == summary(merge(single))
+    assert [[(case.name, case.ok, case.output, case.cached) for case in suite.cases]
+            for suite in merged.suites] == list(CASES.values())
+
+
+def test_merged_report_can_be_merged():
+    merged = merge(report(1, 2), report(2, 2))
+    f = io.StringIO()
+    merged.write_junit(f)
+    f.seek(0)
+    again = JUnitMerger()
+    again.add(f)
+    assert summary(again) == summary(merged)